@@ -0,0 +1,359 @@
+"""
+Benchmarks of the performance options of the models, on the test set of the dataset.
+
+    lowres   : full resolution inference against --lowres_size with guided upsampling, time and PSNR/SSIM cost
+    backends : startup (construction + loading) and latency of the inference backends in --bench_backends
+    amp      : training step time, images/sec, epoch time, peak memory and loss curve for the --bench_amp modes
+    compile  : training step and inference time without and with --compile, first step (compilation) apart
+    channels_last : forward time per encoder/decoder level (skip concatenation included) and of the discriminator, NCHW against NHWC.
+                    The eager modules are not fused: the Conv+ReLU fusion is only measured on a TorchScript
+                    export made with --channels_last=True, through --bench=backends
+    grad_ckpt : training step time, images/sec and peak memory of the --bench_grad_ckpt checkpointing policies
+    ddp      : data-parallel scaling, images/sec and efficiency for the --bench_world numbers of processes
+
+Use:
+
+    python benchmark.py --bench=lowres --load_epoch=1000 --lowres_size=160
+    python benchmark.py --bench=lowres --load_epoch=1000 --lowres_size=160 --bench_images=20
+    python benchmark.py --bench=backends --load_epoch=1000 --bench_backends=eager,torchscript,onnxruntime
+    python benchmark.py --bench=amp --bench_iters=100 --bench_amp=none,fp16,bf16
+    python benchmark.py --bench=compile --bench_iters=50 --load_epoch=1000
+    python benchmark.py --bench=channels_last --bench_iters=20 --gpu_ids=-1
+    python benchmark.py --bench=grad_ckpt --bench_iters=20 --vgg_freezed=False --batch_size=16
+    python benchmark.py --bench=ddp --bench_world=1,2,4,8 --gpu_ids=-1
+
+See options/base.py for more details about more information of all the default parameters.
+"""
+
+import itertools
+import random
+import numpy as np
+import time
+import torch
+import torch.multiprocessing as mp
+
+from models.models import setModel
+from models.nets import vgg16_features
+
+from options.base import baseOpt
+
+from tools.pre import read_train_data
+from tools.loader import TrainLoader
+from tools.pre import get_array_uint8
+from tools.pack import load_image
+from tools.evaluation import sync
+from tools.evaluation import test_pairs
+from tools.evaluation import run_quality
+from tools import distributed
+
+class benchOpt(baseOpt):
+    def initialize(self, parser):
+        parser = baseOpt.initialize(self, parser)
+        parser.add_argument('--bench', type=str, default='lowres', help='benchmark: ' + ', '.join(BENCHES))
+        parser.add_argument('--bench_images', type=int, default=0, help='number of test images used, 0 for all')
+        parser.add_argument('--bench_backends', type=str, default='eager,torchscript', help='backends compared by --bench=backends')
+        parser.add_argument('--bench_amp', type=str, default='none,fp16,bf16', help='mixed precision modes compared by --bench=amp')
+        parser.add_argument('--bench_grad_ckpt', type=str, default='none;dec;top;all', help='checkpointing policies compared by --bench=grad_ckpt, separated by ;')
+        parser.add_argument('--bench_world', type=str, default='1,2,4,8', help='numbers of processes compared by --bench=ddp')
+        parser.add_argument('--bench_iters', type=int, default=50, help='training iterations of the training benchmarks')
+        parser.add_argument('--bench_warmup', type=int, default=2, help='untimed runs before measuring')
+
+        return parser
+
+def bench_lowres(opts):
+    pairs  = test_pairs(opts)
+    model, _ = setModel(opts, False)
+    model.load_model(opts.load_epoch)
+
+    lowres_size = opts.lowres_size if opts.lowres_size > 0 else 160
+
+    rows = []
+    for name, size in (('full', 0), ('lowres-{}'.format(lowres_size), lowres_size)):
+        opts.lowres_size = size
+        t, psnr, ssim = run_quality(model, opts, pairs, 'results/bench/{}/'.format(name))
+        rows.append((name, t, psnr, ssim))
+
+    print('\n{:14}\t{:>10}\t{:>8}\t{:>8}\t{:>7}'.format('mode', 'ms/image', 'PSNR', 'SSIM', 'speedup'))
+    for name, t, psnr, ssim in rows:
+        print('{:14}\t{:10.2f}\t{:8.3f}\t{:8.4f}\t{:6.2f}x'.format(name, 1000.0*t, psnr, ssim, rows[0][1]/t))
+    print('PSNR cost: {:.3f} dB, SSIM cost: {:.4f} on {:d} images'.format(rows[0][2]-rows[1][2], rows[0][3]-rows[1][3], len(pairs)))
+
+def run_latency(model, opts, pairs):
+    """Mean and minimum inference time per image, and time of the first run."""
+    imgs  = [get_array_uint8(load_image(f, opts.dataset_path)) for _, f in pairs]
+    times = []
+    with torch.no_grad():
+        for it, img in enumerate(imgs[:opts.bench_warmup] + imgs):
+            model.set_inputs([img], None)
+
+            sync(model.device)
+            t0 = time.time()
+            model.forward()
+            sync(model.device)
+
+            times.append(time.time() - t0)
+
+    steady = times[opts.bench_warmup:]
+    return np.mean(steady), np.min(steady), times[0]
+
+def bench_backends(opts):
+    pairs = test_pairs(opts)
+
+    rows = []
+    for backend in opts.bench_backends.split(','):
+        opts.backend = backend
+
+        t0 = time.time()
+        model, _ = setModel(opts, False)
+        model.load_model(opts.load_epoch)
+        t_startup = time.time() - t0
+
+        t_mean, t_min, _ = run_latency(model, opts, pairs)
+        rows.append((backend, t_startup, t_mean, t_min))
+
+    print('\n{:14}\t{:>10}\t{:>10}\t{:>10}\t{:>7}'.format('backend', 'startup ms', 'ms/image', 'min ms', 'speedup'))
+    for backend, t_startup, t_mean, t_min in rows:
+        print('{:14}\t{:10.1f}\t{:10.2f}\t{:10.2f}\t{:6.2f}x'.format(backend, 1000.0*t_startup, 1000.0*t_mean, 1000.0*t_min, rows[0][2]/t_mean))
+
+def train_batches(opts, seed=0):
+    """--bench_iters augmented batches, the same for every run of a benchmark."""
+    random.seed(seed)
+    np.random.seed(seed)
+
+    pairs   = read_train_data(opts.dataset_path)
+    n_imgs  = opts.bench_iters * opts.batch_size
+    indices = np.concatenate([np.random.permutation(len(pairs)) for _ in range(n_imgs//len(pairs) + 1)])
+
+    loader  = TrainLoader(pairs,
+                          batch_size  = opts.batch_size,
+                          load_size   = opts.load_size,
+                          crop_size   = opts.crop_size,
+                          num_workers = opts.num_workers,
+                          prefetch    = opts.prefetch)
+    batches = [(f.copy(), a.copy()) for f, a in itertools.islice(loader.epoch(indices), opts.bench_iters)]
+    loader.close()
+
+    return len(pairs), batches
+
+def run_train(opts, batches, seed=0):
+    """Time per training step (warm-up included), loss_R per step and peak device memory, from the same initialization."""
+    torch.manual_seed(seed)
+    model, _ = setModel(opts, True)
+
+    if model.device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(model.device)
+
+    times  = []
+    losses = []
+    for flash_batch, ambnt_batch in batches:
+        sync(model.device)
+        t0 = time.time()
+        model.set_inputs(flash_batch, ambnt_batch)
+        model.optimize_parameters()
+        sync(model.device)
+
+        times.append(time.time() - t0)
+        losses.append(model.loss_R.item())
+
+    peak = torch.cuda.max_memory_allocated(model.device) if model.device.type == 'cuda' else 0
+    return times, losses, peak
+
+def bench_amp(opts):
+    train_size, batches = train_batches(opts)
+
+    rows = []
+    for amp in opts.bench_amp.split(','):
+        opts.amp = amp
+        times, losses, peak = run_train(opts, batches)
+        rows.append((amp, np.mean(times[opts.bench_warmup:]), losses, peak))
+
+    print('\n{:6}\t{:>9}\t{:>10}\t{:>9}\t{:>9}\t{:>10}'.format('amp', 'ms/step', 'images/sec', 'epoch s', 'peak MiB', 'final loss'))
+    for amp, t, losses, peak in rows:
+        ips = opts.batch_size / t
+        print('{:6}\t{:9.1f}\t{:10.1f}\t{:9.1f}\t{:9.0f}\t{:10.4f}'.format(amp, 1000.0*t, ips, train_size/ips, peak/2**20, np.mean(losses[-10:])))
+
+    # Loss curves, sampled on 10 points
+    print('\n{:>6}\t'.format('iter') + '\t'.join('{:>8}'.format(r[0]) for r in rows))
+    for it in range(0, len(batches), max(1, len(batches)//10)):
+        print('{:6d}\t'.format(it+1) + '\t'.join('{:8.4f}'.format(r[2][it]) for r in rows))
+
+def bench_compile(opts):
+    train_size, batches = train_batches(opts)
+    pairs = test_pairs(opts)
+
+    rows = []
+    for compiled in (False, True):
+        opts.compile = compiled
+        times, _, _ = run_train(opts, batches)
+
+        model, _ = setModel(opts, False)
+        if opts.load_epoch > 0:
+            model.load_model(opts.load_epoch)
+        t_infer, _, t_infer_first = run_latency(model, opts, pairs)
+
+        rows.append(('compile' if compiled else 'eager', times[0], np.mean(times[opts.bench_warmup:]), t_infer_first, t_infer))
+
+    print('\n{:8}\t{:>14}\t{:>9}\t{:>10}\t{:>14}\t{:>10}\t{:>7}'.format('mode', 'first step ms', 'ms/step', 'images/sec', 'first infer ms', 'ms/image', 'speedup'))
+    for name, t_first, t_step, t_infer_first, t_infer in rows:
+        print('{:8}\t{:14.1f}\t{:9.1f}\t{:10.1f}\t{:14.1f}\t{:10.2f}\t{:6.2f}x'.format(
+            name, 1000.0*t_first, 1000.0*t_step, opts.batch_size/t_step, 1000.0*t_infer_first, 1000.0*t_infer, rows[0][2]/t_step))
+    print('Run it again for the warm start: the first step then reads the compiled artifacts from the cache.')
+
+def time_modules(groups, device):
+    """Accumulate the forward time of the modules of `groups` ({label: [modules]}) through forward hooks."""
+    totals  = {label: 0.0 for label in groups}
+    handles = []
+    for label, modules in groups.items():
+        for m in modules:
+            def pre(mod, args, label=label):
+                sync(device)
+                mod.t0_bench = time.time()
+            def post(mod, args, out, label=label):
+                sync(device)
+                totals[label] += time.time() - mod.t0_bench
+            handles.append(m.register_forward_pre_hook(pre))
+            handles.append(m.register_forward_hook(post))
+    return totals, handles
+
+def time_levels(net, tag, totals, device):
+    """
+        Accumulate the time of the levels of `net` in totals['<tag><k>'], by wrapping its level() method:
+        the whole level is timed, with the unpooling/deconvolution and the skip concatenation of the
+        decoder. `del net.level` restores the method.
+    """
+    level = net.level
+    def timed(k, *args):
+        sync(device)
+        t0  = time.time()
+        out = level(k, *args)
+        sync(device)
+        label = '{}{}'.format(tag, k)
+        totals[label] = totals.get(label, 0.0) + time.time() - t0
+        return out
+    net.level = timed
+
+def time_pools(gen, totals, device):
+    """
+        Accumulate the time of the max poolings of the encoder in totals['enc<k+1>'], k the rank of the
+        pooling in the forward: the modules are shared (maxpool3 also runs the 4th pooling), the call
+        order is not. Returns the hook handles.
+    """
+    calls = [0]
+    def reset(mod, args):
+        calls[0] = 0
+    def pre(mod, args):
+        sync(device)
+        mod.t0_bench = time.time()
+    def post(mod, args, out):
+        sync(device)
+        calls[0] += 1
+        label = 'enc{}'.format(calls[0] + 1)
+        totals[label] = totals.get(label, 0.0) + time.time() - mod.t0_bench
+
+    handles = [gen.register_forward_pre_hook(reset)]
+    for name, m in gen.enc5.named_children():
+        if name.startswith('maxpool'):
+            handles.append(m.register_forward_pre_hook(pre))
+            handles.append(m.register_forward_hook(post))
+    return handles
+
+def bench_channels_last(opts):
+    sizes = ((224, 224), (240, 320))
+    rows  = {}
+    for channels_last in (False, True):
+        opts.channels_last = channels_last
+        torch.manual_seed(0)
+        model, _ = setModel(opts, True)
+        gen, dis = model.Gen, model.Dis
+
+        # Run outside of the levels, the max poolings are timed by time_pools
+        groups = {'dec0': [gen.dec5.convToCh, gen.dec5.outact], 'dis': [dis]}
+
+        for h, w in sizes:
+            x = torch.rand(opts.batch_size, 3, h, w, device=model.device).contiguous(memory_format=model.memory_format)
+            totals, handles = time_modules(groups, model.device)
+            handles += time_pools(gen, totals, model.device)
+            time_levels(gen.enc5, 'enc', totals, model.device)
+            time_levels(gen.dec5, 'dec', totals, model.device)
+            with torch.no_grad():
+                for it in range(opts.bench_warmup + opts.bench_iters):
+                    if it == opts.bench_warmup:
+                        for label in totals:
+                            totals[label] = 0.0
+                    _, out = gen(x)
+                    dis(out, x.mean(dim=1, keepdim=True))
+            for handle in handles:
+                handle.remove()
+            del gen.enc5.level, gen.dec5.level
+            rows[(channels_last, h, w)] = {label: t/opts.bench_iters for label, t in totals.items()}
+
+    # Encoder levels top-down, decoder levels bottom-up, then the discriminator
+    labels = sorted(rows[(False,) + sizes[0]], key=lambda l: (l == 'dis', l[:3] == 'dec', -int(l[3:]) if l[:3] == 'dec' else int(l[3:] or 0)))
+    for h, w in sizes:
+        print('\n{}x{}, batch {}'.format(h, w, opts.batch_size))
+        print('{:6}\t{:>9}\t{:>9}\t{:>7}'.format('level', 'NCHW ms', 'NHWC ms', 'speedup'))
+        for label in labels + ['total']:
+            if label == 'total':
+                t_nchw = sum(rows[(False, h, w)].values())
+                t_nhwc = sum(rows[(True, h, w)].values())
+            else:
+                t_nchw = rows[(False, h, w)][label]
+                t_nhwc = rows[(True, h, w)][label]
+            print('{:6}\t{:9.2f}\t{:9.2f}\t{:6.2f}x'.format(label, 1000.0*t_nchw, 1000.0*t_nhwc, t_nchw/t_nhwc))
+
+def bench_grad_ckpt(opts):
+    _, batches = train_batches(opts)
+
+    rows = []
+    for policy in opts.bench_grad_ckpt.split(';'):
+        opts.grad_ckpt = policy
+        times, losses, peak = run_train(opts, batches)
+        rows.append((policy, np.mean(times[opts.bench_warmup:]), peak, losses[-1]))
+
+    print('\n{:12}\t{:>9}\t{:>10}\t{:>9}\t{:>9}\t{:>10}'.format('grad_ckpt', 'ms/step', 'images/sec', 'peak MiB', 'memory', 'final loss'))
+    for policy, t, peak, loss in rows:
+        print('{:12}\t{:9.1f}\t{:10.1f}\t{:9.0f}\t{:8.0f}%\t{:10.4f}'.format(
+            policy, 1000.0*t, opts.batch_size/t, peak/2**20, 100.0*peak/max(rows[0][2], 1), loss))
+    if rows[0][2] == 0:
+        print('Peak memory is only measured on CUDA devices.')
+
+def ddp_worker(rank, opts, batches, results):
+    distributed.init_distributed(opts, rank)
+    times, _, _ = run_train(opts, batches)
+    if rank == 0:
+        results.put(np.mean(times[opts.bench_warmup:]))
+    distributed.cleanup()
+
+def bench_ddp(opts):
+    """Weak scaling: every process trains on --bench_iters batches of --batch_size."""
+    _, batches = train_batches(opts)
+    # Built before the processes start, so they only read it
+    vgg16_features(opts.vgg_weights)
+
+    rows = []
+    for world_size in [int(n) for n in opts.bench_world.split(',')]:
+        opts.world_size = world_size
+        results = mp.get_context('spawn').SimpleQueue()
+        mp.spawn(ddp_worker, args=(opts, batches, results), nprocs=world_size)
+        rows.append((world_size, results.get()))
+
+    print('\n{:9}\t{:>9}\t{:>10}\t{:>7}\t{:>10}'.format('processes', 'ms/step', 'images/sec', 'speedup', 'efficiency'))
+    ips_1 = opts.batch_size * rows[0][0] / rows[0][1]
+    for world_size, t in rows:
+        ips = opts.batch_size * world_size / t
+        print('{:9d}\t{:9.1f}\t{:10.1f}\t{:6.2f}x\t{:9.1f}%'.format(
+            world_size, 1000.0*t, ips, ips/ips_1, 100.0*ips/(ips_1*world_size/rows[0][0])))
+
+BENCHES = {
+    'lowres'   : bench_lowres,
+    'backends' : bench_backends,
+    'amp'      : bench_amp,
+    'compile'  : bench_compile,
+    'channels_last' : bench_channels_last,
+    'grad_ckpt'     : bench_grad_ckpt,
+    'ddp'           : bench_ddp
+}
+
+if __name__ == '__main__':
+    opts = benchOpt().parse()
+    BENCHES[opts.bench](opts)
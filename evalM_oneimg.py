@@ -1,13 +1,14 @@
 import os
 import numpy as np
 import time
+import torch
 
 from models.models import setModel
 
 from options.base import baseOpt
 from tools.post import saveimg
-from tools.pre import get_array_to_net
-from PIL import Image
+from tools.pre import get_array_uint8
+from tools.pack import load_image
 
 def eval_op(model, opts):
     results_path = 'results/single/'+opts.model+'_'+opts.upsample+'_'+opts.out_act+'_attgen_'+str(opts.attention_gen)+'_attdis_'+str(opts.attention_dis)+'_epoch-'+str(opts.load_epoch)+'/'
@@ -15,12 +16,13 @@ def eval_op(model, opts):
         os.makedirs(results_path)
 
     t_start = time.time()
-    sample_obj_img = Image.open(opts.sample_dir)
-    sample_img     = get_array_to_net(sample_obj_img, opts.out_act)
+    sample_obj_img = load_image(opts.sample_dir, opts.dataset_path)
+    sample_img     = get_array_uint8(sample_obj_img)
     
     # Set inputs of the model and run 
-    model.set_inputs([sample_img], None)  
-    model.forward()
+    with torch.no_grad():
+        model.set_inputs([sample_img], None)  
+        model.forward()
     saveimg(results_path, opts.sample_dir.split('/')[-1][:-9]+'synth.png', model.fake_Y, opts.out_act)
     print('New sample convereted...')
 
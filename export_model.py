@@ -0,0 +1,78 @@
+"""
+Export the generator of a checkpoint 'model-<epoch>.pth' into a self-contained artifact, next to it in
+the checkpoints directory.
+
+    torchscript : traced and frozen TorchScript module, 'model-<epoch>.torchscript.pt'
+    onnx        : ONNX graph with dynamic batch/height/width, 'model-<epoch>.onnx'
+    flat        : memory-mapped checkpoint 'model-<epoch>.safetensors' (fp16 with --ckpt_half=True),
+                  loaded in place of the .pth by test.py and evalM_oneimg.py
+
+The TorchScript and ONNX artifacts are checked against the eager generator (ONNX with onnxruntime), also
+on a size that is not a multiple of 16, which the backends pad.
+
+Use:
+
+    python export_model.py --load_epoch=1000
+    python export_model.py --load_epoch=1000 --format=torchscript
+    python export_model.py --load_epoch=1000 --format=onnx
+    python export_model.py --load_epoch=1000 --format=flat --ckpt_half=True
+
+The exported generator runs with test.py and evalM_oneimg.py (--backend=torchscript or onnxruntime), the
+TorchScript one also without the model code at all with infer.py.
+"""
+
+from models.models import setModel
+from models.backends import export_path
+from models.backends import export_torchscript
+from models.backends import export_onnx
+from models.backends import export_config
+from models.backends import TorchScriptGenerator
+from models.backends import OnnxRuntimeGenerator
+from models.backends import parity_check
+from models.checkpoint import checkpoint_path
+from models.checkpoint import save_flat
+
+from options.base import baseOpt
+
+def export_op(model, opts):
+    if opts.format == 'flat':
+        path = checkpoint_path(opts, opts.load_epoch, 'flat')
+        save_flat(model.Gen.state_dict(), path, export_config(opts), opts.ckpt_half)
+        print('Exported "{}"'.format(path))
+        return
+
+    path = export_path(opts, opts.load_epoch, opts.format)
+    model.Gen.eval()
+
+    if opts.format == 'torchscript':
+        export_torchscript(model.Gen, opts, path, model.device)
+    elif opts.format == 'onnx':
+        export_onnx(model.Gen, opts, path, model.device)
+    else:
+        print('Non available format...')
+        return
+
+    print('Exported "{}"'.format(path))
+
+    # Different sizes, to check the dynamic axes and the padding of the sizes off the multiple of 16
+    sizes = [(opts.load_size, opts.load_size*4//3), (opts.crop_size, opts.crop_size), (250, 333)]
+    if opts.format == 'torchscript':
+        backend = TorchScriptGenerator(path, model.device)
+    else:
+        backend = OnnxRuntimeGenerator(path, model.device, opts.num_threads, opts.num_interop_threads)
+    ok, results = parity_check(model.Gen, backend, sizes, model.device)
+    for size, d_max, d_mean in results:
+        print('\tparity {}x{}\tmax abs diff: {:.2e}\tmean abs diff: {:.2e}'.format(size[0], size[1], d_max, d_mean))
+    print('Parity check {}'.format('passed' if ok else 'FAILED'))
+
+if __name__ == "__main__":
+    # Get parameters
+    opts = baseOpt().parse()
+    # The export always starts from the eager generator
+    opts.backend = 'eager'
+
+    print('Exporting {} model to {}'.format(opts.model, opts.format))
+    model, _ = setModel(opts, False)
+
+    model.load_model(opts.load_epoch)
+    export_op(model, opts)
@@ -0,0 +1,74 @@
+"""
+Python-light inference runner for an exported TorchScript generator (see export_model.py). It only needs
+torch, numpy and PIL: no torchvision, no options parser of the project and no model construction.
+
+Use:
+
+    python infer.py --model=checkpoints/model-1000.torchscript.pt --out_dir=results/ts/ IMG [IMG ...]
+    python infer.py --model=checkpoints/model-1000.torchscript.pt --device=cuda:0 IMG
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from PIL import Image
+
+def load(path, device):
+    extra  = {'config.json': ''}
+    module = torch.jit.load(path, map_location=device, _extra_files=extra)
+    return module, json.loads(extra['config.json'])
+
+def run(module, config, img, device):
+    x = torch.from_numpy(np.asarray(img, dtype=np.uint8)).to(device)
+    x = x.permute(2, 0, 1).unsqueeze(0).float().div_(255.0)
+    if config['out_act'] == 'tanh':
+        x = x.mul_(2.0).sub_(1.0)
+
+    # The output padding of the decoder deconvolutions is fixed by the trace, right only for the
+    # sizes multiple of the downsampling factor: pad to one and crop the output back
+    H, W = x.shape[-2:]
+    multiple = 2**(config['levels']-1)
+    x = F.pad(x, (0, (-W) % multiple, 0, (-H) % multiple), mode='replicate')
+
+    out = module(x)[..., :H, :W]
+
+    if config['out_act'] == 'tanh':
+        out = out * 0.5 + 0.5
+    out = out.mul(255.0).clamp_(0, 255).to(torch.uint8)
+    return out[0].permute(1, 2, 0).cpu().numpy()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='exported TorchScript generator')
+    parser.add_argument('--out_dir', default='results/infer/', help='output directory')
+    parser.add_argument('--device', default='cpu', help='cpu, cuda:0, ...')
+    parser.add_argument('--num_threads', type=int, default=0, help='intra-op threads of the CPU path, 0 for the torch default')
+    parser.add_argument('images', nargs='+', help='flash images')
+    args = parser.parse_args()
+
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    t_start = time.time()
+    device  = torch.device(args.device)
+    module, config = load(args.model, device)
+    print('startup: {:.1f}ms ({})'.format(1000.0*(time.time()-t_start), config))
+
+    with torch.no_grad():
+        for f in args.images:
+            with Image.open(f) as img:
+                img = img.convert('RGB')
+
+            t0  = time.time()
+            out = run(module, config, img, device)
+            t1  = time.time()
+
+            Image.fromarray(out).save(os.path.join(args.out_dir, os.path.basename(f)))
+            print('{}: {:.1f}ms'.format(f, 1000.0*(t1-t0)))
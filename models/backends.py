@@ -0,0 +1,180 @@
+"""
+Exported generators and the inference backends running them.
+
+The exported graphs take the normalized float NCHW batch built by set_inputs and return the output
+image of the generator. The backends wrap them as callables with the same (z, out) signature of the
+eager generator, so the tiled and low resolution modes of models/inference.py work with all of them.
+"""
+
+import json
+import os
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+EXPORT_FILES = {
+    'torchscript' : 'model-{}.torchscript.pt',
+    'onnx'        : 'model-{}.onnx',
+    'onnxruntime' : 'model-{}.onnx',
+    'int8'        : 'model-{}.int8.torchscript.pt',
+}
+
+def export_path(opts, ep, fmt):
+    return os.path.join(opts.checkpoints_dir, EXPORT_FILES[fmt].format(str(ep)))
+
+def export_config(opts):
+    return {
+        'model'    : opts.model,
+        'upsample' : opts.upsample,
+        'out_act'  : opts.out_act,
+        'levels'   : 5
+    }
+
+class GeneratorOutput(nn.Module):
+    """Generator returning only the output image, the graph that gets exported."""
+    def __init__(self, gen):
+        super(GeneratorOutput, self).__init__()
+        self.gen = gen
+
+    def forward(self, input_imgs):
+        _, out = self.gen(input_imgs)
+        return out
+
+def size_multiple(config):
+    """Downsampling factor of the encoder, the exported graphs only run on sizes multiple of it."""
+    return 2**(config['levels']-1)
+
+def pad_forward(run, input_imgs, multiple=16):
+    """
+        Output of `run` on the input replicate-padded to a multiple of `multiple`, cropped back. The
+        output padding of the decoder deconvolutions (output_size=) is a constant of the traced and
+        ONNX graphs, right only for the sizes multiple of the downsampling factor.
+    """
+    H, W = input_imgs.shape[-2:]
+    pad_h, pad_w = (-H) % multiple, (-W) % multiple
+    if pad_h or pad_w:
+        input_imgs = F.pad(input_imgs, (0, pad_w, 0, pad_h), mode='replicate')
+    return run(input_imgs)[..., :H, :W]
+
+def example_input(opts, device):
+    # A multiple of 16, the exported graphs get every input padded to one (see pad_forward)
+    h = max(16, opts.load_size - opts.load_size % 16)
+    w = max(16, opts.load_size*4//3 - opts.load_size*4//3 % 16)
+    x = torch.rand(1, 3, h, w, device=device)
+    return x.contiguous(memory_format=torch.channels_last) if opts.channels_last else x
+
+def export_torchscript(gen, opts, path, device, qengine=None):
+    net = GeneratorOutput(gen).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(net, example_input(opts, device), check_trace=False)
+    traced = torch.jit.freeze(traced)
+    if opts.channels_last and qengine is None:
+        # Folds the Conv+ReLU pairs into fused NHWC kernels (oneDNN on the CPU), the
+        # artifact is then specialized to the device it was exported on
+        traced = torch.jit.optimize_for_inference(traced)
+
+    config = export_config(opts)
+    if qengine is not None:
+        config['qengine'] = qengine
+    torch.jit.save(traced, path, _extra_files={'config.json': json.dumps(config)})
+    return path
+
+class TorchScriptGenerator:
+    def __init__(self, path, device):
+        extra = {'config.json': ''}
+        self.module = torch.jit.load(path, map_location=device, _extra_files=extra)
+        self.config = json.loads(extra['config.json'])
+        self.multiple = size_multiple(self.config)
+
+        # int8 generator, it runs with the engine it was quantized for
+        self.device = device
+        if 'qengine' in self.config:
+            torch.backends.quantized.engine = self.config['qengine']
+
+    def __call__(self, input_imgs):
+        out = pad_forward(lambda x: self.module(x.to(self.device)), input_imgs, self.multiple)
+        return None, out.to(input_imgs.device)
+
+def export_onnx(gen, opts, path, device):
+    """ONNX graph with dynamic batch, height and width, so one file serves every resolution (padded, see pad_forward)."""
+    import onnx
+
+    net  = GeneratorOutput(gen).eval()
+    axes = {0: 'batch', 2: 'height', 3: 'width'}
+    with torch.no_grad():
+        torch.onnx.export(net, example_input(opts, device), path,
+                          opset_version = 13,
+                          input_names   = ['flash'],
+                          output_names  = ['ambient'],
+                          dynamic_axes  = {'flash': axes, 'ambient': axes})
+
+    model = onnx.load(path)
+    meta  = model.metadata_props.add()
+    meta.key   = 'config.json'
+    meta.value = json.dumps(export_config(opts))
+    onnx.save(model, path)
+    return path
+
+class OnnxRuntimeGenerator:
+    def __init__(self, path, device, num_threads=0, num_interop_threads=0):
+        import onnxruntime as ort
+
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            so.intra_op_num_threads = num_threads
+        if num_interop_threads > 0:
+            so.inter_op_num_threads = num_interop_threads
+            so.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        providers = ['CPUExecutionProvider']
+        if device.type == 'cuda' and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers = [('CUDAExecutionProvider', {'device_id': device.index or 0})] + providers
+
+        self.session = ort.InferenceSession(path, sess_options=so, providers=providers)
+        self.config  = json.loads(self.session.get_modelmeta().custom_metadata_map['config.json'])
+        self.multiple = size_multiple(self.config)
+
+    def run(self, input_imgs):
+        # NCHW input, a channels-last tensor has NHWC strides
+        return torch.from_numpy(self.session.run(None, {'flash': input_imgs.detach().cpu().contiguous().numpy()})[0])
+
+    def __call__(self, input_imgs):
+        out = pad_forward(self.run, input_imgs, self.multiple)
+        return None, out.to(input_imgs.device)
+
+def parity_check(gen, backend, sizes, device, tol=1e-3):
+    """
+        Max and mean absolute difference between the eager generator and a backend, per input size.
+        The eager generator runs on the same padded input as the backend.
+    """
+    results = []
+    with torch.no_grad():
+        for h, w in sizes:
+            x = torch.rand(1, 3, h, w, device=device)
+            ref = pad_forward(lambda t: gen(t)[1], x)
+            _, out = backend(x)
+            diff = (ref - out.to(ref.device)).abs()
+            results.append(((h, w), diff.max().item(), diff.mean().item()))
+
+    ok = all(d_max < tol for _, d_max, _ in results)
+    return ok, results
+
+def load_backend(opts, ep, device):
+    path = export_path(opts, ep, opts.backend)
+    print('Loading {} backend from "{}"'.format(opts.backend, path))
+
+    if opts.backend == 'torchscript':
+        gen = TorchScriptGenerator(path, device)
+    elif opts.backend == 'int8':
+        # Quantized kernels only run on the CPU
+        gen = TorchScriptGenerator(path, torch.device('cpu'))
+    elif opts.backend == 'onnxruntime':
+        gen = OnnxRuntimeGenerator(path, device, opts.num_threads, opts.num_interop_threads)
+    else:
+        raise ValueError('Non available backend: {}'.format(opts.backend))
+
+    if gen.config['out_act'] != opts.out_act:
+        print('out_act of the exported model is "{}", using it'.format(gen.config['out_act']))
+        opts.out_act = gen.config['out_act']
+    return gen
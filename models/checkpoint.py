@@ -0,0 +1,195 @@
+"""
+Generator checkpoints: the pickled state dict 'model-<epoch>.pth', or the flat 'model-<epoch>.safetensors'.
+Training states: 'state-<epoch>.pth', with the networks, optimizers, gradient scaler and RNG states.
+
+The flat format follows the safetensors layout: a little-endian u64 with the size of a JSON header, the
+header (name -> dtype, shape, byte range of every tensor, and the model config in '__metadata__'), then
+the raw tensor data. Loading maps the file copy-on-write, so the tensors are views into the page cache:
+nothing is deserialized, and several inference workers share one copy of the weights.
+"""
+
+import json
+import os
+import random
+import struct
+import threading
+import numpy as np
+import torch
+
+from .backends import export_config
+
+CKPT_FILES = {
+    'pth'   : 'model-{}.pth',
+    'flat'  : 'model-{}.safetensors',
+    'state' : 'state-{}.pth'
+}
+
+DTYPES = {
+    torch.float32  : 'F32',
+    torch.float16  : 'F16',
+    torch.bfloat16 : 'BF16',
+    torch.int64    : 'I64',
+    torch.int32    : 'I32',
+    torch.uint8    : 'U8',
+    torch.bool     : 'BOOL'
+}
+TORCH_DTYPES = {v: k for k, v in DTYPES.items()}
+
+def checkpoint_path(opts, ep, fmt):
+    return os.path.join(opts.checkpoints_dir, CKPT_FILES[fmt].format(str(ep)))
+
+def save_flat(state_dict, path, config, half=False):
+    """Write `state_dict` in the flat format, fp32 tensors stored in fp16 when `half`."""
+    tensors = {}
+    for name, t in state_dict.items():
+        t = t.detach().cpu().contiguous()
+        tensors[name] = t.half() if half and t.dtype == torch.float32 else t
+
+    # Largest elements first, so every tensor starts aligned to its element size
+    names  = sorted(tensors, key=lambda k: (-tensors[k].element_size(), k))
+    header = {'__metadata__': {'config': json.dumps(config)}}
+    offset = 0
+    for name in names:
+        t = tensors[name]
+        end = offset + t.numel() * t.element_size()
+        header[name] = {'dtype': DTYPES[t.dtype], 'shape': list(t.shape), 'data_offsets': [offset, end]}
+        offset = end
+
+    header = json.dumps(header).encode('utf-8')
+    header += b' ' * ((-len(header)) % 8)
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name in names:
+            f.write(tensors[name].reshape(-1).view(torch.uint8).numpy().tobytes())
+    os.replace(path + '.tmp', path)
+    return path
+
+def load_flat(path):
+    """Zero-copy state dict of a flat checkpoint and its model config."""
+    with open(path, 'rb') as f:
+        n_header = struct.unpack('<Q', f.read(8))[0]
+        header   = json.loads(f.read(n_header))
+    meta = header.pop('__metadata__', {})
+
+    data = torch.from_numpy(np.memmap(path, dtype=np.uint8, mode='c', offset=8+n_header))
+    state_dict = {}
+    for name, entry in header.items():
+        begin, end = entry['data_offsets']
+        state_dict[name] = data[begin:end].view(TORCH_DTYPES[entry['dtype']]).reshape(entry['shape'])
+
+    return state_dict, json.loads(meta['config']) if 'config' in meta else None
+
+def save_checkpoint(state_dict, opts, ep):
+    path = checkpoint_path(opts, ep, opts.ckpt_format)
+    if opts.ckpt_format == 'flat':
+        return save_flat(state_dict, path, export_config(opts), opts.ckpt_half)
+    torch.save(state_dict, path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return path
+
+def load_checkpoint(opts, ep, device):
+    """State dict and config (None for .pth) of the epoch `ep`, from the flat checkpoint when there is one."""
+    path = checkpoint_path(opts, ep, 'flat')
+    if os.path.exists(path):
+        return load_flat(path)
+    return torch.load(checkpoint_path(opts, ep, 'pth'), map_location=str(device)), None
+
+def load_into(net, state_dict, device, zero_copy=True):
+    """
+        Load `state_dict` into `net`. On the CPU, when the dtypes and layouts match, the tensors are
+        assigned as they are instead of copied, so the parameters stay views of the mapped file. Not
+        for training (`zero_copy` False): the optimizers and DDP hold the original parameters.
+    """
+    params = net.state_dict()
+    assign = zero_copy and device.type == 'cpu' and all(
+        k in params and params[k].dtype == v.dtype and params[k].is_contiguous() for k, v in state_dict.items())
+    net.load_state_dict(state_dict, assign=assign)
+
+def rng_state():
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def snapshot(obj):
+    """Host copy of the tensors of a nested state, queued on the current stream for the CUDA ones."""
+    if torch.is_tensor(obj):
+        obj = obj.detach()
+        return obj.to('cpu', non_blocking=True) if obj.is_cuda else obj.clone()
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+class AsyncCheckpointer:
+    """
+        Writes the training states (and the generator checkpoint) on a background thread. save() only
+        takes a snapshot on the host, the training continues while it is written. Files are written
+        to a temporary name then renamed, so a crash never leaves a partial checkpoint, and only the
+        last `keep` training states are kept (0 keeps all).
+    """
+    def __init__(self, opts, keep=0):
+        self.opts   = opts
+        self.keep   = keep
+        self.thread = None
+        self.error  = None
+
+    def save(self, state, ep):
+        # One write in flight at most
+        self.wait()
+
+        snap  = snapshot(state)
+        event = None
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            event = torch.cuda.Event()
+            event.record()
+
+        self.thread = threading.Thread(target=self.write, args=(snap, event, ep), daemon=True)
+        self.thread.start()
+
+    def write(self, snap, event, ep):
+        try:
+            if event is not None:
+                event.synchronize()
+            save_checkpoint(snap['Gen'], self.opts, ep)
+
+            path = checkpoint_path(self.opts, ep, 'state')
+            torch.save(snap, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            self.rotate()
+        except Exception as e:
+            self.error = e
+
+    def rotate(self):
+        if self.keep <= 0:
+            return
+        prefix, suffix = CKPT_FILES['state'].split('{}')
+        epochs = sorted(int(f[len(prefix):-len(suffix)]) for f in os.listdir(self.opts.checkpoints_dir)
+                        if f.startswith(prefix) and f.endswith(suffix) and f[len(prefix):-len(suffix)].isdigit())
+        for ep in epochs[:-self.keep]:
+            os.remove(checkpoint_path(self.opts, ep, 'state'))
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+def load_training_state(opts, ep):
+    """Training state of the epoch `ep`, or None when there is only the generator checkpoint."""
+    path = checkpoint_path(opts, ep, 'state')
+    if not os.path.exists(path):
+        return None
+    return torch.load(path, map_location='cpu', weights_only=False)
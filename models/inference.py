@@ -0,0 +1,110 @@
+import math
+import torch
+import torch.nn.functional as F
+
+def tile_starts(size, tile, stride):
+    starts = list(range(0, size - tile + 1, stride))
+    if starts[-1] + tile < size:
+        starts.append(size - tile)
+    return starts
+
+def feather_window(tile_h, tile_w, overlap, device):
+    """Weights of a tile, ramping linearly from the borders over `overlap` pixels."""
+    def ramp(size):
+        w = torch.ones(size, device=device)
+        if overlap > 0:
+            r = torch.arange(1, overlap+1, dtype=torch.float32, device=device) / (overlap+1)
+            w[:overlap]  = r
+            w[-overlap:] = r.flip(0)
+        return w
+
+    return (ramp(tile_h)[:, None] * ramp(tile_w)[None, :])[None, None]
+
+def tiled_forward(gen, input_imgs, tile=512, overlap=32, batch=4, multiple=16):
+    """
+        Run the generator on overlapping tiles of the input and feather-blend the seams, so peak memory
+        depends on the tile size and not on the image size.
+
+        tile, overlap and the tile positions are aligned to `multiple`, the downsampling factor of the
+        encoder (16 for 5 levels). The input is padded to a multiple of it, the output is cropped back.
+    """
+    N, _, H, W = input_imgs.size()
+    Hp = int(math.ceil(H/multiple)) * multiple
+    Wp = int(math.ceil(W/multiple)) * multiple
+    if (Hp, Wp) != (H, W):
+        input_imgs = F.pad(input_imgs, (0, Wp-W, 0, Hp-H), mode='replicate')
+
+    tile    = max(multiple, tile - tile % multiple)
+    tile_h  = min(tile, Hp)
+    tile_w  = min(tile, Wp)
+    overlap = min(overlap - overlap % multiple, min(tile_h, tile_w)//2)
+    overlap -= overlap % multiple
+    stride  = max(multiple, min(tile_h, tile_w) - overlap)
+
+    window  = feather_window(tile_h, tile_w, overlap, input_imgs.device)
+    boxes   = [(y, x) for y in tile_starts(Hp, tile_h, stride) for x in tile_starts(Wp, tile_w, stride)]
+
+    out  = None
+    norm = torch.zeros(1, 1, Hp, Wp, device=input_imgs.device)
+
+    for k in range(0, len(boxes), batch):
+        chunk  = boxes[k:k+batch]
+        tiles  = torch.cat([input_imgs[:, :, y:y+tile_h, x:x+tile_w] for y, x in chunk], dim=0)
+        _, res = gen(tiles)
+
+        if out is None:
+            out = torch.zeros(N, res.size(1), Hp, Wp, device=res.device, dtype=res.dtype)
+
+        for j, (y, x) in enumerate(chunk):
+            out[:, :, y:y+tile_h, x:x+tile_w]  += res[j*N:(j+1)*N] * window
+            norm[:, :, y:y+tile_h, x:x+tile_w] += window
+
+    return (out / norm)[:, :, :H, :W]
+
+def box_filter(x, r):
+    return F.avg_pool2d(x, kernel_size=2*r+1, stride=1, padding=r, count_include_pad=False)
+
+def guided_upsample(guide_lo, out_lo, guide, r=4, eps=1e-4):
+    """
+        Fast guided upsampling: the local linear model out = a * guide + b of the guided filter is fitted
+        at low resolution, channel by channel, then its coefficients are upsampled and applied to the full
+        resolution guide, which brings back the edges of the flash image.
+    """
+    mean_I  = box_filter(guide_lo, r)
+    mean_p  = box_filter(out_lo, r)
+    cov_Ip  = box_filter(guide_lo * out_lo, r) - mean_I * mean_p
+    var_I   = box_filter(guide_lo * guide_lo, r) - mean_I * mean_I
+
+    a = cov_Ip / (var_I + eps)
+    b = mean_p - a * mean_I
+
+    size   = guide.shape[-2:]
+    mean_a = F.interpolate(box_filter(a, r), size=size, mode='bilinear', align_corners=False)
+    mean_b = F.interpolate(box_filter(b, r), size=size, mode='bilinear', align_corners=False)
+
+    return mean_a * guide + mean_b
+
+def lowres_forward(run, input_imgs, lowres_size, r=4, eps=1e-4, multiple=16):
+    """Run the generator on a copy of the input downscaled to `lowres_size` (longest side), then guided-upsample it."""
+    H, W  = input_imgs.shape[-2:]
+    scale = lowres_size / float(max(H, W))
+    h_lo  = max(multiple, int(round(H*scale/multiple)) * multiple)
+    w_lo  = max(multiple, int(round(W*scale/multiple)) * multiple)
+
+    guide_lo = F.interpolate(input_imgs, size=(h_lo, w_lo), mode='area')
+    out_lo   = run(guide_lo)
+
+    return guided_upsample(guide_lo, out_lo, input_imgs, r, eps)
+
+def inference_forward(gen, input_imgs, opts):
+    """Inference output of the generator, whole, on tiles (--tile_size) and/or at low resolution (--lowres_size)."""
+    def run(x):
+        if opts.tile_size > 0:
+            return tiled_forward(gen, x, opts.tile_size, opts.tile_overlap, opts.tile_batch)
+        return gen(x)[1]
+
+    if opts.lowres_size > 0 and max(input_imgs.shape[-2:]) > opts.lowres_size:
+        out = lowres_forward(run, input_imgs, opts.lowres_size, opts.guided_radius, opts.guided_eps)
+        # The linear model can overshoot the range of the output activation
+        return out.clamp(-1.0 if opts.out_act == 'tanh' else 0.0, 1.0)
+    return run(input_imgs)
@@ -4,30 +4,120 @@ if torch.cuda.is_available():
 	torch.cuda.manual_seed_all(20)
 
 import torch.nn as nn
+import torch.distributed as dist
 import os
 import numpy as np
-
-from torchvision import transforms
+import contextlib
 
 from .nets import vgg16_generator_unpool
 from .nets import vgg16_generator_deconv
 from .nets import discriminator
 from .nets import GANLoss
+from .inference import inference_forward
+from .backends import load_backend
+from .checkpoint import load_checkpoint
+from .checkpoint import load_into
+
+def get_device(opts):
+	if len(opts.gpu_ids) > 0 and torch.cuda.is_available():
+		return torch.device('cuda:{}'.format(opts.gpu_ids[0]))
+	return torch.device('cpu')
+
+def set_cpu_threads(opts):
+	"""Intra-op and inter-op thread pools of the CPU path, 0 keeps the defaults of torch."""
+	if opts.num_threads > 0:
+		torch.set_num_threads(opts.num_threads)
+	if opts.num_interop_threads > 0:
+		try:
+			torch.set_num_interop_threads(opts.num_interop_threads)
+		except RuntimeError:
+			# Only allowed once, before any inter-op parallel work
+			print('num_interop_threads already set to {}'.format(torch.get_num_interop_threads()))
+
+AMP_DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+def amp_context(device, amp):
+	"""Autocast region of the opt-in mixed precision mode (--amp), no-op for 'none'."""
+	if amp in AMP_DTYPES:
+		return torch.autocast(device_type=device.type, dtype=AMP_DTYPES[amp])
+	return contextlib.nullcontext()
+
+def grad_scaler(device, amp):
+	# Only fp16 on CUDA needs the loss scaling, bf16 has the range of fp32
+	return torch.amp.GradScaler('cuda', enabled=(amp == 'fp16' and device.type == 'cuda'))
+
+def compile_net(net, opts):
+	"""Compile the forward of `net` in place (the keys of its state_dict do not change). The compiled
+	artifacts are cached in <checkpoints_dir>/compile_cache, so warm starts skip the compilation."""
+	os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.abspath(os.path.join(opts.checkpoints_dir, 'compile_cache')))
+	os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+	os.environ.setdefault('TORCHINDUCTOR_AUTOGRAD_CACHE', '1')
+	net.compile()
+	return net
+
+def distribute(net, device):
+	"""DistributedDataParallel replica of `net` when the process group is initialized (see tools/distributed.py)."""
+	if not (dist.is_available() and dist.is_initialized()):
+		return net
+	return nn.parallel.DistributedDataParallel(net, device_ids=[device.index] if device.type == 'cuda' else None)
+
+def unwrap(net):
+	return net.module if isinstance(net, nn.parallel.DistributedDataParallel) else net
+
+def no_sync(nets, sync):
+	"""Skip the gradient all-reduce of the DDP replicas in `nets` on the micro-batches that do not step."""
+	stack = contextlib.ExitStack()
+	if not sync:
+		for net in nets:
+			if isinstance(net, nn.parallel.DistributedDataParallel):
+				stack.enter_context(net.no_sync())
+	return stack
+
+def phase(telemetry, name):
+	"""Timed phase of an iteration (see tools/telemetry.py), no-op without telemetry."""
+	return telemetry.phase(name) if telemetry is not None else contextlib.nullcontext()
+
+def rescale_grads(optimizer, factor):
+	for group in optimizer.param_groups:
+		for p in group['params']:
+			if p.grad is not None:
+				p.grad.mul_(factor)
+
+def trainable(net):
+	# Frozen parameters get neither Adam state nor updates
+	return [p for p in net.parameters() if p.requires_grad]
+
+def to_net_tensor(imgs, device, out_act, memory_format=torch.contiguous_format):
+	"""Move a uint8 NHWC batch (array, list of arrays or tensor) to `device` and
+	scale it to the range of the network as a float NCHW tensor, in one step on the batch."""
+	if not torch.is_tensor(imgs):
+		imgs = torch.from_numpy(np.ascontiguousarray(np.stack(imgs)))
+	out = imgs.to(device, non_blocking=True).permute(0, 3, 1, 2).float()
+	if out_act == 'tanh':
+		out = out.mul_(2.0/255.0).sub_(1.0)
+	else:
+		out = out.div_(255.0)
+	return out.contiguous(memory_format=memory_format)
 
 class VGG_ED:
 	def __init__(self, opts, isTrain=True):
 		self.opts    = opts
 		self.isTrain =  isTrain
-		self.device  = torch.device('cuda:{}'.format(self.opts.gpu_ids[0])) if self.opts.gpu_ids else torch.device('cpu') 
-		self.attention = opts.attention
+		self.device  = get_device(opts)
+		self.memory_format = torch.channels_last if opts.channels_last else torch.contiguous_format
+		self.attention = opts.attention_gen
 		if isTrain:
 			print('Training mode [{}]'.format(self.device))
 			if opts.upsample == 'deconv':
-				self.Gen = vgg16_generator_deconv(levels=5, opts=opts).cuda()
+				self.Gen = vgg16_generator_deconv(levels=5, opts=opts).to(self.device)
 			elif opts.upsample == 'unpool':
-				self.Gen = vgg16_generator_unpool(levels=5, opts=opts).cuda()
+				self.Gen = vgg16_generator_unpool(levels=5, opts=opts).to(self.device)
 
-			self.Gen.set_vgg_as_encoder()	
+			self.Gen.set_vgg_as_encoder(opts.vgg_weights)
+			if opts.vgg_freezed: self.Gen.freeze_encoder()
+			self.Gen.set_grad_ckpt(opts.grad_ckpt)
+			if opts.channels_last: self.Gen.set_channels_last()
+			if opts.compile: compile_net(self.Gen, opts)
 			
 			if   opts.R_loss == 'Cauchy': self.criterion = self.CauchyLoss
 			elif opts.R_loss == 'L1'    : self.criterion = torch.nn.L1Loss()
@@ -36,17 +126,33 @@ class VGG_ED:
 			print('\tmodel      \t{}'.format(opts.model))
 			print('\tloss 	  \t{}'.format(opts.R_loss))
 			print('\tupsample \t{}'.format(opts.upsample))
-			print('\tAttention\t{}'.format(opts.attention))
+			print('\tAttention\t{}'.format(self.attention))
 			print('\tvgg_freezed\t{}'.format(opts.vgg_freezed))
+			print('\tamp      \t{}'.format(opts.amp))
+			print('\tcompile  \t{}'.format(opts.compile))
+			print('\tchannels_last\t{}'.format(opts.channels_last))
+			print('\tgrad_ckpt\t{}'.format(opts.grad_ckpt))
+			print('\taccum_steps\t{}'.format(opts.accum_steps))
 			print('\tout_act  \t{}\n'.format(opts.out_act))
-			self.optimizer_gen = torch.optim.Adam(self.Gen.parameters(), lr=opts.lr1, betas=(opts.beta1, 0.999))
+			self.optimizer_gen = torch.optim.Adam(trainable(self.Gen), lr=opts.lr1, betas=(opts.beta1, 0.999))
+			self.scaler        = grad_scaler(self.device, opts.amp)
+			self.Gen           = distribute(self.Gen, self.device)
+			# Micro-batches accumulated since the last optimizer step (--accum_steps)
+			self.micro_step    = 0
+			self.telemetry     = None
 		else:
 			print('Testing mode![on {}]\n'.format(self.device))
-			if opts.upsample == 'deconv':
-				self.Gen = vgg16_generator_deconv(levels=5, opts=opts).cuda()
+			if opts.backend != 'eager':
+				# Exported generator, loaded by load_model
+				self.Gen = None
+			elif opts.upsample == 'deconv':
+				# No pretrained initialization, load_model sets all the weights
+				self.Gen = vgg16_generator_deconv(levels=5, opts=opts).to(self.device)
 			elif opts.upsample == 'unpool':
-				self.Gen = vgg16_generator_unpool(levels=5, opts=opts).cuda()
-			self.Gen.set_vgg_as_encoder()
+				self.Gen = vgg16_generator_unpool(levels=5, opts=opts).to(self.device)
+			if self.Gen is not None:
+				if opts.channels_last: self.Gen.set_channels_last()
+				if opts.compile: compile_net(self.Gen, opts)
 
 	def CauchyLoss(self, inputs, targets, C=0.1): # C=0.1 -> 0.1*255/2=12.75[0-255]
 		diff_err = inputs-targets
@@ -54,27 +160,52 @@ class VGG_ED:
 		return loss_raw.mean()
 
 	def set_inputs(self, inputs, targets=None):
-		self.real_X = torch.cuda.FloatTensor(inputs)
+		self.real_X = to_net_tensor(inputs, self.device, self.opts.out_act, self.memory_format)
 		if targets is not None: 
-			self.real_Y = torch.cuda.FloatTensor(targets)
+			self.real_Y = to_net_tensor(targets, self.device, self.opts.out_act, self.memory_format)
 			if self.attention:
 				self.att_map= 1.0 - torch.abs(self.real_X - self.real_Y).mean(dim=1, keepdim=True)
 
 	def forward(self):
-		self.Z, self.fake_Y = self.Gen(self.real_X)
+		if not self.isTrain:
+			self.Z = None
+			with amp_context(self.device, self.opts.amp if self.opts.backend == 'eager' else 'none'):
+				self.fake_Y = inference_forward(self.Gen, self.real_X, self.opts).float()
+		else:
+			with amp_context(self.device, self.opts.amp):
+				self.Z, self.fake_Y = self.Gen(self.real_X)
 		
 	def backward_gen(self):
+		# The loss is computed in fp32 in the mixed precision mode too
+		fake_Y = self.fake_Y.float()
 		if self.attention:
-			self.loss_R = self.criterion(self.fake_Y * self.att_map, self.real_Y * self.att_map)
+			self.loss_R = self.criterion(fake_Y * self.att_map, self.real_Y * self.att_map)
 		else: 
-			self.loss_R = self.criterion(self.fake_Y, self.real_Y)
-		self.loss_R.backward()
-
-	def optimize_parameters(self):
-		self.optimizer_gen.zero_grad()
-		self.forward()
-		self.backward_gen()
-		self.optimizer_gen.step()
+			self.loss_R = self.criterion(fake_Y, self.real_Y)
+		# Mean over the accumulated micro-batches, loss_R stays the loss of this one
+		self.scaler.scale(self.loss_R / self.opts.accum_steps).backward()
+
+	def optimize_parameters(self, last=False):
+		"""Forward/backward of a micro-batch, the optimizer steps every --accum_steps micro-batches and on the `last` one."""
+		if self.micro_step == 0:
+			self.optimizer_gen.zero_grad()
+		self.micro_step += 1
+		update = last or self.micro_step == self.opts.accum_steps
+
+		with no_sync([self.Gen], update):
+			with phase(self.telemetry, 'gen_forward'):
+				self.forward()
+			with phase(self.telemetry, 'gen_backward'):
+				self.backward_gen()
+
+		if update:
+			with phase(self.telemetry, 'optimizer'):
+				if self.micro_step < self.opts.accum_steps:
+					# Short accumulation at the end of the epoch, still a mean
+					rescale_grads(self.optimizer_gen, self.opts.accum_steps / self.micro_step)
+				self.scaler.step(self.optimizer_gen)
+				self.scaler.update()
+			self.micro_step = 0
 
 	def set_requires_grad(self, nets, requires_grad=False):
 		"""Set requies_grad=Fasle for all the networks to avoid unnecessary computations
@@ -89,37 +220,55 @@ class VGG_ED:
 				for param in net.parameters():
 					param.requires_grad = requires_grad
 
-	def save_model(self, ep):
-		file_model = 'model-{}.pth'.format(str(ep))
-		save_path = os.path.join(self.opts.checkpoints_dir, file_model)
+	def training_state(self):
+		return {
+			'Gen'           : unwrap(self.Gen).state_dict(),
+			'optimizer_gen' : self.optimizer_gen.state_dict(),
+			'scaler'        : self.scaler.state_dict()
+		}
 
-		if len(self.opts.gpu_ids) > 0 and torch.cuda.is_available():
-			torch.save(self.Gen.cpu().state_dict(), save_path)
-			self.Gen.cuda()
+	def load_training_state(self, state):
+		unwrap(self.Gen).load_state_dict(state['Gen'])
+		self.optimizer_gen.load_state_dict(state['optimizer_gen'])
+		if state['scaler']:
+			self.scaler.load_state_dict(state['scaler'])
 
 	def load_model(self, ep):
-		file_model = 'model-{}.pth'.format(str(ep))
-		load_path  = os.path.join(self.opts.checkpoints_dir, file_model)
-		state_dict = torch.load(load_path, map_location=str(self.device))
+		if self.opts.backend != 'eager':
+			self.Gen = load_backend(self.opts, ep, self.device)
+			return
+
+		state_dict, config = load_checkpoint(self.opts, ep, self.device)
+		if config is not None:
+			if config['upsample'] != self.opts.upsample:
+				raise ValueError('Checkpoint of an "{}" generator, not "{}"'.format(config['upsample'], self.opts.upsample))
+			if config['out_act'] != self.opts.out_act:
+				print('out_act of the checkpoint is "{}", using it'.format(config['out_act']))
+				self.opts.out_act = config['out_act']
 
-		self.Gen.load_state_dict(state_dict)
+		load_into(unwrap(self.Gen), state_dict, self.device, zero_copy=not self.isTrain)
 
 class advModel:
 	def __init__(self, opts, isTrain=True):
 		self.opts    = opts
 		self.isTrain = isTrain
-		self.device  = torch.device('cuda:{}'.format(self.opts.gpu_ids[0])) if self.opts.gpu_ids else torch.device('cpu') 
+		self.device  = get_device(opts)
+		self.memory_format = torch.channels_last if opts.channels_last else torch.contiguous_format
 		self.attention_gen = opts.attention_gen
 		self.attention_dis = opts.attention_dis
 
 		if isTrain:
 			print('Training mode [{}]'.format(self.device))
 			if opts.upsample == 'deconv':
-				self.Gen = vgg16_generator_deconv(levels=5, opts=opts).cuda()
+				self.Gen = vgg16_generator_deconv(levels=5, opts=opts).to(self.device)
 			elif opts.upsample == 'unpool':
-				self.Gen = vgg16_generator_unpool(levels=5, opts=opts).cuda()
+				self.Gen = vgg16_generator_unpool(levels=5, opts=opts).to(self.device)
 
-			self.Gen.set_vgg_as_encoder()	
+			self.Gen.set_vgg_as_encoder(opts.vgg_weights)
+			if opts.vgg_freezed: self.Gen.freeze_encoder()
+			self.Gen.set_grad_ckpt(opts.grad_ckpt)
+			if opts.channels_last: self.Gen.set_channels_last()
+			if opts.compile: compile_net(self.Gen, opts)
 			
 			if   opts.R_loss == 'Cauchy': self.criterion = self.CauchyLoss
 			elif opts.R_loss == 'L1'    : self.criterion = torch.nn.L1Loss()
@@ -131,53 +280,83 @@ class advModel:
 			print('\tAttention gen\t{}'.format(opts.attention_gen))
 			print('\tAttention dis\t{}'.format(opts.attention_dis))
 			print('\tvgg_freezed\t{}'.format(opts.vgg_freezed))
+			print('\tamp      \t{}'.format(opts.amp))
+			print('\tcompile  \t{}'.format(opts.compile))
+			print('\tchannels_last\t{}'.format(opts.channels_last))
+			print('\tgrad_ckpt\t{}'.format(opts.grad_ckpt))
+			print('\taccum_steps\t{}'.format(opts.accum_steps))
 			print('\tout_act  \t{}\n'.format(opts.out_act))
 
-			self.Dis = discriminator(deep=6, down_leves=5, ksize=3, att=opts.attention_dis).cuda()
-			self.criterionGAN  = GANLoss().cuda()
-			self.optimizer_gen = torch.optim.Adam(self.Gen.parameters(), lr=opts.lr1, betas=(opts.beta1, 0.999))
+			self.Dis = discriminator(deep=6, down_leves=5, ksize=3, att=opts.attention_dis).to(self.device)
+			if opts.channels_last: self.Dis.to(memory_format=torch.channels_last)
+			if opts.compile: compile_net(self.Dis, opts)
+			self.criterionGAN  = GANLoss().to(self.device)
+			self.optimizer_gen = torch.optim.Adam(trainable(self.Gen), lr=opts.lr1, betas=(opts.beta1, 0.999))
 			self.optimizer_dis = torch.optim.Adam(self.Dis.parameters(), lr=opts.lr2, betas=(opts.beta1, 0.999))
+			# One scaler for both optimizers, updated once per iteration
+			self.scaler        = grad_scaler(self.device, opts.amp)
+			self.Gen           = distribute(self.Gen, self.device)
+			# Micro-batches accumulated since the last optimizer step (--accum_steps)
+			self.micro_step    = 0
+			self.telemetry     = None
+			self.Dis           = distribute(self.Dis, self.device)
 
 		else:
 			print('Testing mode![on {}]\n'.format(self.device))
-			if opts.upsample == 'deconv':
-				self.Gen = vgg16_generator_deconv(levels=5, opts=opts).cuda()
+			if opts.backend != 'eager':
+				# Exported generator, loaded by load_model
+				self.Gen = None
+			elif opts.upsample == 'deconv':
+				# No pretrained initialization, load_model sets all the weights
+				self.Gen = vgg16_generator_deconv(levels=5, opts=opts).to(self.device)
 			elif opts.upsample == 'unpool':
-				self.Gen = vgg16_generator_unpool(levels=5, opts=opts).cuda()
-			self.Gen.set_vgg_as_encoder()
+				self.Gen = vgg16_generator_unpool(levels=5, opts=opts).to(self.device)
+			if self.Gen is not None:
+				if opts.channels_last: self.Gen.set_channels_last()
+				if opts.compile: compile_net(self.Gen, opts)
 
 	def CauchyLoss(self, inputs, targets, C=0.1):
 		diff_err = inputs-targets
 		loss_raw = C * torch.log(torch.mul(diff_err, diff_err)/(C*C)+1)
-		return loss_raw.mean(0)
+		return loss_raw.mean()
 
 	def set_inputs(self, inputs, targets):
-		self.real_X = torch.cuda.FloatTensor(inputs)
+		self.real_X = to_net_tensor(inputs, self.device, self.opts.out_act, self.memory_format)
 		if targets is not None: 
-			self.real_Y = torch.cuda.FloatTensor(targets)
+			self.real_Y = to_net_tensor(targets, self.device, self.opts.out_act, self.memory_format)
 			if self.attention_gen or self.attention_dis:
 				self.att_map= 1.0 - torch.abs(self.real_X - self.real_Y).mean(dim=1, keepdim=True)
 
 	def forward(self):
-		_, self.fake_Y = self.Gen(self.real_X)
+		if not self.isTrain:
+			with amp_context(self.device, self.opts.amp if self.opts.backend == 'eager' else 'none'):
+				self.fake_Y = inference_forward(self.Gen, self.real_X, self.opts).float()
+		else:
+			with amp_context(self.device, self.opts.amp):
+				_, self.fake_Y = self.Gen(self.real_X)
 
 	def backward_gen(self):
 		#synthetic_pair = torch.cat((self.real_X, self.fake_Y), dim=1)
 		# We set mode=real, because we will use the first term of the BCEWithLogitsLoss
 		
+		# The losses are computed in fp32 in the mixed precision mode too
+		fake_Y = self.fake_Y.float()
 		if self.attention_gen:
-			self.loss_R  = self.criterion(self.fake_Y * self.att_map, self.real_Y * self.att_map)
+			self.loss_R  = self.criterion(fake_Y * self.att_map, self.real_Y * self.att_map)
 		else: 
-			self.loss_R  = self.criterion(self.fake_Y, self.real_Y)
-
-		if self.attention_dis:
-			dis_out_fake = self.Dis(self.fake_Y, self.att_map)
-		else:
-			dis_out_fake = self.Dis(self.fake_Y)
+			self.loss_R  = self.criterion(fake_Y, self.real_Y)
+
+		# The frozen discriminator runs outside of its DDP wrapper, it has no gradients to all-reduce here
+		dis = unwrap(self.Dis)
+		with amp_context(self.device, self.opts.amp):
+			if self.attention_dis:
+				dis_out_fake = dis(self.fake_Y, self.att_map)
+			else:
+				dis_out_fake = dis(self.fake_Y)
 		
-		self.loss_Gen  = self.criterionGAN(dis_out_fake, 'real')   # log(D(G(x)))
+		self.loss_Gen  = self.criterionGAN(dis_out_fake.float(), 'real')   # log(D(G(x)))
 		self.loss_Gen_L1 = self.loss_R + self.loss_Gen * self.opts.lambda_GAN
-		self.loss_Gen_L1.backward()	
+		self.scaler.scale(self.loss_Gen_L1 / self.opts.accum_steps).backward()	
 
 	def backward_dis(self):
 		#synthetic_pair = torch.cat((self.real_X, self.fake_Y), dim=1)
@@ -185,33 +364,68 @@ class advModel:
 
 		# No backpropagation along the generator (detach)
 
-		if self.attention_dis:
-			dis_out_fake = self.Dis(self.fake_Y.detach(), self.att_map)
-			dis_out_real = self.Dis(self.real_Y, self.att_map)
-		else:
-			dis_out_fake = self.Dis(self.fake_Y.detach())
-			dis_out_real = self.Dis(self.real_Y)
+		with amp_context(self.device, self.opts.amp):
+			if self.attention_dis:
+				dis_out_fake = self.Dis(self.fake_Y.detach(), self.att_map)
+				dis_out_real = self.Dis(self.real_Y, self.att_map)
+			else:
+				dis_out_fake = self.Dis(self.fake_Y.detach())
+				dis_out_real = self.Dis(self.real_Y)
 
-		self.loss_dis_fake = self.criterionGAN(dis_out_fake, 'fake')  # log(1-D(x_hat)))
-		self.loss_dis_real = self.criterionGAN(dis_out_real, 'real')  # log(D(x)))
+		self.loss_dis_fake = self.criterionGAN(dis_out_fake.float(), 'fake')  # log(1-D(x_hat)))
+		self.loss_dis_real = self.criterionGAN(dis_out_real.float(), 'real')  # log(D(x)))
 
 		self.loss_Dis  = self.loss_dis_fake + self.loss_dis_real
 		self.loss_Dis_ = self.loss_Dis * self.opts.lambda_GAN
-		self.loss_Dis_.backward()
-
-	def optimize_parameters(self):
-		# Update Discriminator
-		self.forward()
-		self.set_requires_grad(self.Dis, True)
-		self.optimizer_dis.zero_grad()
-		self.backward_dis()
-		self.optimizer_dis.step()
-
-		# Update Generator
-		self.set_requires_grad(self.Dis, False)
-		self.optimizer_gen.zero_grad()
-		self.backward_gen()
-		self.optimizer_gen.step()
+		self.scaler.scale(self.loss_Dis_ / self.opts.accum_steps).backward()
+
+	def optimize_parameters(self, last=False):
+		"""
+			Forward/backward of a micro-batch. The gradients of both networks are accumulated, and
+			the optimizers step every --accum_steps micro-batches and on the `last` one. With
+			--accum_steps=1 it is the usual alternate update of the discriminator and the generator.
+			With more, the discriminator steps after the last generator backward, so all the
+			generator gradients of the group come from the same discriminator, as in one large batch.
+		"""
+		# Discriminator step right after its backward only for single micro-batch groups
+		dis_first = self.opts.accum_steps == 1
+
+		if self.micro_step == 0:
+			self.optimizer_dis.zero_grad()
+			self.optimizer_gen.zero_grad()
+		self.micro_step += 1
+		update = last or self.micro_step == self.opts.accum_steps
+
+		with no_sync([self.Gen, self.Dis], update):
+			with phase(self.telemetry, 'gen_forward'):
+				self.forward()
+
+			# Discriminator
+			self.set_requires_grad(self.Dis, True)
+			with phase(self.telemetry, 'dis_forward_backward'):
+				self.backward_dis()
+			if update and dis_first:
+				self.step(self.optimizer_dis)
+
+			# Generator, the backward pass goes through the discriminator too
+			self.set_requires_grad(self.Dis, False)
+			with phase(self.telemetry, 'gen_backward'):
+				self.backward_gen()
+			if update:
+				if not dis_first:
+					self.step(self.optimizer_dis)
+				self.step(self.optimizer_gen)
+
+		if update:
+			self.scaler.update()
+			self.micro_step = 0
+
+	def step(self, optimizer):
+		with phase(self.telemetry, 'optimizer'):
+			if self.micro_step < self.opts.accum_steps:
+				# Short accumulation at the end of the epoch, still a mean
+				rescale_grads(optimizer, self.opts.accum_steps / self.micro_step)
+			self.scaler.step(optimizer)
 
 	def set_requires_grad(self, nets, requires_grad=False):
 		"""Set requies_grad=Fasle for all the networks to avoid unnecessary computations
@@ -226,22 +440,40 @@ class advModel:
 				for param in net.parameters():
 					param.requires_grad = requires_grad
 
-	def save_model(self, ep):
-		file_model = 'model-{}.pth'.format(str(ep))
-		save_path = os.path.join(self.opts.checkpoints_dir, file_model)
-
-		if len(self.opts.gpu_ids) > 0 and torch.cuda.is_available():
-			torch.save(self.Gen.cpu().state_dict(), save_path)
-			self.Gen.cuda()
+	def training_state(self):
+		return {
+			'Gen'           : unwrap(self.Gen).state_dict(),
+			'Dis'           : unwrap(self.Dis).state_dict(),
+			'optimizer_gen' : self.optimizer_gen.state_dict(),
+			'optimizer_dis' : self.optimizer_dis.state_dict(),
+			'scaler'        : self.scaler.state_dict()
+		}
+
+	def load_training_state(self, state):
+		unwrap(self.Gen).load_state_dict(state['Gen'])
+		unwrap(self.Dis).load_state_dict(state['Dis'])
+		self.optimizer_gen.load_state_dict(state['optimizer_gen'])
+		self.optimizer_dis.load_state_dict(state['optimizer_dis'])
+		if state['scaler']:
+			self.scaler.load_state_dict(state['scaler'])
 
 	def load_model(self, ep):
-		file_model = 'model-{}.pth'.format(str(ep))
-		load_path  = os.path.join(self.opts.checkpoints_dir, file_model)
-		state_dict = torch.load(load_path, map_location=str(self.device))
+		if self.opts.backend != 'eager':
+			self.Gen = load_backend(self.opts, ep, self.device)
+			return
+
+		state_dict, config = load_checkpoint(self.opts, ep, self.device)
+		if config is not None:
+			if config['upsample'] != self.opts.upsample:
+				raise ValueError('Checkpoint of an "{}" generator, not "{}"'.format(config['upsample'], self.opts.upsample))
+			if config['out_act'] != self.opts.out_act:
+				print('out_act of the checkpoint is "{}", using it'.format(config['out_act']))
+				self.opts.out_act = config['out_act']
 
-		self.Gen.load_state_dict(state_dict)
+		load_into(unwrap(self.Gen), state_dict, self.device, zero_copy=not self.isTrain)
 
 def setModel(opts, isTrain=True):
+	set_cpu_threads(opts)
 	if opts.model == 'advModel':
 		return advModel(opts, isTrain), True
 	elif opts.model == 'VGG_ED':
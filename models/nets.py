@@ -1,8 +1,71 @@
+import os
+import contextlib
 import torch
 import torch.nn as nn
 
 from .vgg import vgg16_encoder, vgg16_decoder
 
+# Index in torchvision's vgg16().features of every convolution of vgg16_encoder
+VGG16_FEATURES = {
+    'conv1_1':  0, 'conv1_2':  2,
+    'conv2_1':  5, 'conv2_2':  7,
+    'conv3_1': 10, 'conv3_2': 12, 'conv3_3': 14,
+    'conv4_1': 17, 'conv4_2': 19, 'conv4_3': 21,
+    'conv5_1': 24, 'conv5_2': 26, 'conv5_3': 28
+}
+
+def vgg16_features(path):
+    """
+        State dict of the convolutional features of the pretrained VGG16, read from the local cache
+        `path`. The first call builds the cache from torchvision (one download), without the classifier.
+    """
+    if not os.path.exists(path):
+        from torchvision import models
+
+        print('Caching the VGG16 features in "{}"'.format(path))
+        features = models.vgg16(pretrained=True, progress=True).features
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Per-process temporary file, concurrent builds never see a partial cache
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        torch.save(features.state_dict(), tmp)
+        os.replace(tmp, path)
+
+    return torch.load(path, map_location='cpu')
+
+def load_vgg16_features(enc, path):
+    """Copy the pretrained VGG16 weights into the convolutions of the encoder `enc`."""
+    state = vgg16_features(path)
+    with torch.no_grad():
+        for name, idx in VGG16_FEATURES.items():
+            if hasattr(enc, name):
+                getattr(enc, name).weight.copy_(state['{}.weight'.format(idx)])
+                getattr(enc, name).bias.copy_(state['{}.bias'.format(idx)])
+
+# Levels recomputed in the backward pass by each --grad_ckpt policy, any list like 'enc1,dec1' works too
+GRAD_CKPT_POLICIES = {
+    'none' : '',
+    'enc'  : 'enc1,enc2,enc3,enc4,enc5',
+    'dec'  : 'dec1,dec2,dec3,dec4',
+    'top'  : 'enc1,enc2,dec1,dec2',  # [224x224] and [112x112], most of the activations
+    'all'  : 'enc1,enc2,enc3,enc4,enc5,dec1,dec2,dec3,dec4'
+}
+
+def grad_ckpt_levels(policy):
+    """Checkpointed levels of the encoder and of the decoder for a --grad_ckpt policy."""
+    enc, dec = set(), set()
+    for item in filter(None, GRAD_CKPT_POLICIES.get(policy, policy).split(',')):
+        if item[:3] not in ('enc', 'dec') or not item[3:].isdigit():
+            raise ValueError('Non available --grad_ckpt level: {}'.format(item))
+        (enc if item[:3] == 'enc' else dec).add(int(item[3:]))
+    return enc, dec
+
+def profile_scope(name):
+    """Label of the ops run in the scope, for the profiler (see tools/profiling.py), kept out of traced graphs."""
+    if torch.jit.is_tracing():
+        return contextlib.nullcontext()
+    return torch.profiler.record_function(name)
+
 class vgg16_generator_unpool(nn.Module):
     def __init__(self, levels, opts):
         super(vgg16_generator_unpool, self).__init__()
@@ -11,61 +74,34 @@ class vgg16_generator_unpool(nn.Module):
         self.enc5   = vgg16_encoder(levels=levels)
         self.dec5   = vgg16_decoder(levels=levels, mode=opts.upsample, out_act=opts.out_act)
         self.levels = levels
+        self.enc_frozen = False
 
     def forward(self, input_imgs):  
         
-        layers  = self.enc5.unpool_forward(input_imgs)
+        # Frozen encoder: no graph, only the skip tensors and pooling indices used by the decoder are kept
+        with torch.set_grad_enabled(torch.is_grad_enabled() and not self.enc_frozen), profile_scope('vgg16_encoder'):
+            layers  = self.enc5.unpool_forward(input_imgs)
         att_map = input_imgs.mean(dim=1, keepdim=True)
-        out_img = self.dec5.unpool_forward(layers, att_map = att_map)
+        with profile_scope('vgg16_decoder'):
+            out_img = self.dec5.unpool_forward(layers, att_map = att_map)
             
         return layers['z'], out_img
 
-    def set_vgg_as_encoder(self):
-        from torchvision import models
-        
-        vgg16 = models.vgg16(pretrained=True, progress=True)
-        features_list = list(vgg16.features)
-
-        # [224x224]
-        if self.levels > 1:
-            self.enc5.conv1_1.weight.copy_(features_list[0].weight)
-            self.enc5.conv1_1.bias.copy_(features_list[0].bias)
-            self.enc5.conv1_2.weight.copy_(features_list[2].weight)
-            self.enc5.conv1_2.bias.copy_(features_list[2].bias)
-            
-        # [112x112]
-        if self.levels > 2:
-            self.enc5.conv2_1.weight.copy_(features_list[5].weight)
-            self.enc5.conv2_1.bias.copy_(features_list[5].bias)
-            self.enc5.conv2_2.weight.copy_(features_list[7].weight)
-            self.enc5.conv2_2.bias.copy_(features_list[7].bias)
-
-        # [56x56]
-        if self.levels > 3:
-            self.enc5.conv3_1.weight.copy_(features_list[10].weight)
-            self.enc5.conv3_1.bias.copy_(features_list[10].bias)
-            self.enc5.conv3_2.weight.copy_(features_list[12].weight)
-            self.enc5.conv3_2.bias.copy_(features_list[12].bias)
-            self.enc5.conv3_3.weight.copy_(features_list[14].weight)
-            self.enc5.conv3_3.bias.copy_(features_list[14].bias)
-
-        # [28x28]
-        if self.levels > 4:
-            self.enc5.conv4_1.weight.copy_(features_list[17].weight)
-            self.enc5.conv4_1.bias.copy_(features_list[17].bias)
-            self.enc5.conv4_2.weight.copy_(features_list[19].weight)
-            self.enc5.conv4_2.bias.copy_(features_list[19].bias)
-            self.enc5.conv4_3.weight.copy_(features_list[21].weight)
-            self.enc5.conv4_3.bias.copy_(features_list[21].bias)
-
-        # [14x14]
-        if self.levels > 5:
-            self.enc5.conv5_1.weight.copy_(features_list[24].weight)
-            self.enc5.conv5_1.bias.copy_(features_list[24].bias)
-            self.enc5.conv5_2.weight.copy_(features_list[26].weight)
-            self.enc5.conv5_2.bias.copy_(features_list[26].bias)
-            self.enc5.conv5_3.weight.copy_(features_list[28].weight)
-            self.enc5.conv5_3.bias.copy_(features_list[28].bias)
+    def set_channels_last(self):
+        self.to(memory_format=torch.channels_last)
+        self.dec5.memory_format = torch.channels_last
+
+    def freeze_encoder(self):
+        """Fixed pretrained encoder (--vgg_freezed): out of the optimizer and run without gradients."""
+        for param in self.enc5.parameters():
+            param.requires_grad = False
+        self.enc_frozen = True
+
+    def set_vgg_as_encoder(self, path):
+        load_vgg16_features(self.enc5, path)
+
+    def set_grad_ckpt(self, policy):
+        self.enc5.ckpt_levels, self.dec5.ckpt_levels = grad_ckpt_levels(policy)
 
 class vgg16_generator_deconv(nn.Module):        
     def __init__(self, levels, opts):
@@ -75,62 +111,34 @@ class vgg16_generator_deconv(nn.Module):
         self.enc5   = vgg16_encoder(levels=levels)
         self.dec5   = vgg16_decoder(levels=levels, mode=opts.upsample, out_act=opts.out_act)
         self.levels = levels
+        self.enc_frozen = False
 
     def forward(self, input_imgs):  
 
-        layers  = self.enc5.deconv_forward(input_imgs)
+        # Frozen encoder: no graph, only the skip tensors and pooling indices used by the decoder are kept
+        with torch.set_grad_enabled(torch.is_grad_enabled() and not self.enc_frozen), profile_scope('vgg16_encoder'):
+            layers  = self.enc5.deconv_forward(input_imgs)
         att_map = input_imgs.mean(dim=1, keepdim=True)
-        out_img = self.dec5.deconv_forward(layers, att_map = att_map)
+        with profile_scope('vgg16_decoder'):
+            out_img = self.dec5.deconv_forward(layers, att_map = att_map)
             
         return layers['z'], out_img
 
-    def set_vgg_as_encoder(self):
-        from torchvision import models
-        
-        vgg16 = models.vgg16(pretrained=True, progress=True)
-        features_list = list(vgg16.features)
-
-        if True:
-            if self.levels > 0:
-                # [224x224]
-                self.enc5.conv1_1.weight.copy_(features_list[0].weight)
-                self.enc5.conv1_1.bias.copy_(features_list[0].bias)
-                self.enc5.conv1_2.weight.copy_(features_list[2].weight)
-                self.enc5.conv1_2.bias.copy_(features_list[2].bias)
-            
-            if self.levels > 1:
-                # [112x112]
-                self.enc5.conv2_1.weight.copy_(features_list[5].weight)
-                self.enc5.conv2_1.bias.copy_(features_list[5].bias)
-                self.enc5.conv2_2.weight.copy_(features_list[7].weight)
-                self.enc5.conv2_2.bias.copy_(features_list[7].bias)
-
-            if self.levels > 2:
-                # [56x56]
-                self.enc5.conv3_1.weight.copy_(features_list[10].weight)
-                self.enc5.conv3_1.bias.copy_(features_list[10].bias)
-                self.enc5.conv3_2.weight.copy_(features_list[12].weight)
-                self.enc5.conv3_2.bias.copy_(features_list[12].bias)
-                self.enc5.conv3_3.weight.copy_(features_list[14].weight)
-                self.enc5.conv3_3.bias.copy_(features_list[14].bias)
-
-            if self.levels > 3:
-                # [28x28]
-                self.enc5.conv4_1.weight.copy_(features_list[17].weight)
-                self.enc5.conv4_1.bias.copy_(features_list[17].bias)
-                self.enc5.conv4_2.weight.copy_(features_list[19].weight)
-                self.enc5.conv4_2.bias.copy_(features_list[19].bias)
-                self.enc5.conv4_3.weight.copy_(features_list[21].weight)
-                self.enc5.conv4_3.bias.copy_(features_list[21].bias)
-
-            if self.levels > 4:
-                # [14x14]
-                self.enc5.conv5_1.weight.copy_(features_list[24].weight)
-                self.enc5.conv5_1.bias.copy_(features_list[24].bias)
-                self.enc5.conv5_2.weight.copy_(features_list[26].weight)
-                self.enc5.conv5_2.bias.copy_(features_list[26].bias)
-                self.enc5.conv5_3.weight.copy_(features_list[28].weight)
-                self.enc5.conv5_3.bias.copy_(features_list[28].bias)
+    def set_channels_last(self):
+        self.to(memory_format=torch.channels_last)
+        self.dec5.memory_format = torch.channels_last
+
+    def freeze_encoder(self):
+        """Fixed pretrained encoder (--vgg_freezed): out of the optimizer and run without gradients."""
+        for param in self.enc5.parameters():
+            param.requires_grad = False
+        self.enc_frozen = True
+
+    def set_vgg_as_encoder(self, path):
+        load_vgg16_features(self.enc5, path)
+
+    def set_grad_ckpt(self, policy):
+        self.enc5.ckpt_levels, self.dec5.ckpt_levels = grad_ckpt_levels(policy)
 
 class discriminator(nn.Module):
     def __init__(
@@ -195,9 +203,10 @@ class discriminator(nn.Module):
 
 
     def forward(self, input_pair, att_map=None):
-        if self.att:
-            input_pair = torch.mul(input_pair, att_map)
-        out = self.dis_arch(input_pair) #[28x28]
+        with profile_scope('discriminator'):
+            if self.att:
+                input_pair = torch.mul(input_pair, att_map)
+            out = self.dis_arch(input_pair) #[28x28]
         return out
 
 class GANLoss(nn.Module):
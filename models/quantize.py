@@ -0,0 +1,94 @@
+"""
+Post-training static int8 quantization of the generator, for CPU inference (eager mode quantization).
+
+The Conv+ReLU pairs of vgg16_encoder and of the convBlock sequences of vgg16_decoder are fused, and
+every run of convolutions is wrapped between a QuantStub and a DeQuantStub: the convolutions run in
+int8, the max-pooling with indices, the unpooling/transposed convolutions, the skip concatenations and
+the output activation stay in float.
+"""
+
+import copy
+import torch
+import torch.nn as nn
+
+from torch.ao.quantization import QuantStub
+from torch.ao.quantization import DeQuantStub
+from torch.ao.quantization import fuse_modules
+from torch.ao.quantization import get_default_qconfig
+from torch.ao.quantization import prepare
+from torch.ao.quantization import convert
+
+ENCODER_LEVELS = [
+    ['conv1_1', 'conv1_2'],
+    ['conv2_1', 'conv2_2'],
+    ['conv3_1', 'conv3_2', 'conv3_3'],
+    ['conv4_1', 'conv4_2', 'conv4_3'],
+    ['conv5_1', 'conv5_2', 'conv5_3']
+]
+
+FLOAT_MODULES = (nn.ConvTranspose2d, nn.MaxPool2d, nn.MaxUnpool2d, nn.Sigmoid, nn.Tanh)
+
+def decoder_blocks(dec):
+    return [getattr(dec, 'conv_block{}'.format(k)) for k in range(1, 5) if hasattr(dec, 'conv_block{}'.format(k))]
+
+def fuse_generator(gen):
+    """Fuse Conv+ReLU in place: the convs become ConvReLU2d and the ReLUs Identity."""
+    enc = gen.enc5
+    for level in ENCODER_LEVELS:
+        pairs = [[c, c.replace('conv', 'relu')] for c in level if hasattr(enc, c)]
+        if pairs:
+            fuse_modules(enc, pairs, inplace=True)
+
+    for block in decoder_blocks(gen.dec5):
+        pairs = [[str(i), str(i+1)] for i in range(len(block)-1)
+                 if isinstance(block[i], nn.Conv2d) and isinstance(block[i+1], nn.ReLU)]
+        fuse_modules(block, pairs, inplace=True)
+    return gen
+
+def insert_stubs(gen):
+    enc = gen.enc5
+    for level in ENCODER_LEVELS:
+        level = [c for c in level if hasattr(enc, c)]
+        if not level:
+            continue
+        setattr(enc, level[0],  nn.Sequential(QuantStub(), getattr(enc, level[0])))
+        setattr(enc, level[-1], nn.Sequential(getattr(enc, level[-1]), DeQuantStub()))
+
+    dec = gen.dec5
+    for k in range(1, 5):
+        name = 'conv_block{}'.format(k)
+        if hasattr(dec, name):
+            setattr(dec, name, nn.Sequential(QuantStub(), *getattr(dec, name), DeQuantStub()))
+    if hasattr(dec, 'convToCh'):
+        dec.convToCh = nn.Sequential(QuantStub(), dec.convToCh, DeQuantStub())
+    return gen
+
+def default_qengine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            return engine
+    return engines[0]
+
+def quantize_generator(gen, calib_batches, qengine=''):
+    """int8 copy of the generator, calibrated on the float NCHW batches of `calib_batches`."""
+    qengine = qengine or default_qengine()
+    torch.backends.quantized.engine = qengine
+
+    qgen = copy.deepcopy(gen).cpu().eval()
+    fuse_generator(qgen)
+    insert_stubs(qgen)
+
+    qgen.qconfig = get_default_qconfig(qengine)
+    for m in qgen.modules():
+        # Kept in float, they take the dequantized outputs
+        if isinstance(m, FLOAT_MODULES):
+            m.qconfig = None
+    prepare(qgen, inplace=True)
+
+    with torch.no_grad():
+        for x in calib_batches:
+            qgen(x.cpu())
+
+    convert(qgen, inplace=True)
+    return qgen, qengine
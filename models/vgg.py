@@ -1,6 +1,26 @@
 import torch
 import torch.nn as nn
 
+from functools import partial
+from torch.utils.checkpoint import checkpoint
+
+def max_unpool(unpool, input, indices, enc_out):
+    """
+        MaxUnpool2d to the size of the skip tensor `enc_out`. max_unpool2d has no ONNX symbolic, so
+        while exporting it is written as a scatter of the input into the flattened planes of zeros.
+    """
+    if torch.onnx.is_in_onnx_export():
+        out = torch.zeros_like(enc_out).flatten(2)
+        out = out.scatter(2, indices.flatten(2), input.flatten(2))
+        return out.view_as(enc_out)
+    return unpool(input, indices, output_size=enc_out.size())
+
+def run_level(ckpt, fn, *args):
+    """fn(*args), without keeping its activations when `ckpt`: they are recomputed in the backward pass."""
+    if ckpt and torch.is_grad_enabled():
+        return checkpoint(fn, *args, use_reentrant=False)
+    return fn(*args)
+
 class vgg16_encoder(nn.Module):
     def __init__(
         self, 
@@ -8,6 +28,8 @@ class vgg16_encoder(nn.Module):
 
         super(vgg16_encoder, self).__init__()
         self.levels   = levels
+        # Levels recomputed in the backward pass (--grad_ckpt)
+        self.ckpt_levels = set()
 
         self.conv1_1 = nn.Conv2d(in_channels = 3,
                                  out_channels= 64,
@@ -89,16 +111,23 @@ class vgg16_encoder(nn.Module):
         self.relu5_3  = nn.ReLU(inplace=True)
         # [14x14]
 
+    def convs(self, k, out):
+        n = 2 if k < 3 else 3
+        for i in range(1, n+1):
+            out = getattr(self, 'conv{}_{}'.format(k, i))(out)
+            out = getattr(self, 'relu{}_{}'.format(k, i))(out)
+        return out
+
+    def level(self, k, input):
+        return run_level(k in self.ckpt_levels, partial(self.convs, k), input)
+
     def unpool_forward(
         self,
         input):
 
         layers = {}
 
-        out    = self.conv1_1(input)
-        out    = self.relu1_1(out)
-        out    = self.conv1_2(out)
-        out1   = self.relu1_2(out)
+        out1   = self.level(1, input)
         
         if self.levels < 2: 
             layers['z'] = out1
@@ -107,10 +136,7 @@ class vgg16_encoder(nn.Module):
         layers['out1'] = out1
         out, pool1_idx = self.maxpool1(out1)
 
-        out  = self.conv2_1(out)
-        out  = self.relu2_1(out)
-        out  = self.conv2_2(out)
-        out2 = self.relu2_2(out)
+        out2 = self.level(2, out)
 
         layers['pool1_idx'] = pool1_idx
 
@@ -121,12 +147,7 @@ class vgg16_encoder(nn.Module):
         layers['out2'] = out2
         out, pool2_idx = self.maxpool2(out2)
 
-        out  = self.conv3_1(out)
-        out  = self.relu3_1(out)
-        out  = self.conv3_2(out)
-        out  = self.relu3_2(out)
-        out  = self.conv3_3(out)
-        out3 = self.relu3_3(out)
+        out3 = self.level(3, out)
 
         layers['pool2_idx'] = pool2_idx  
         
@@ -137,12 +158,7 @@ class vgg16_encoder(nn.Module):
         layers['out3'] = out3
         out, pool3_idx = self.maxpool3(out3)
 
-        out  = self.conv4_1(out)
-        out  = self.relu4_1(out)
-        out  = self.conv4_2(out)
-        out  = self.relu4_2(out)
-        out  = self.conv4_3(out)
-        out4 = self.relu4_3(out)
+        out4 = self.level(4, out)
 
         layers['pool3_idx'] = pool3_idx
         
@@ -153,12 +169,7 @@ class vgg16_encoder(nn.Module):
         layers['out4'] = out4
         out, pool4_idx = self.maxpool3(out4)
 
-        out = self.conv5_1(out)
-        out = self.relu5_1(out)
-        out = self.conv5_2(out)
-        out = self.relu5_2(out)
-        out = self.conv5_3(out)
-        out = self.relu5_3(out)
+        out = self.level(5, out)
 
         layers['z'] = out
         layers['pool4_idx'] = pool4_idx
@@ -171,10 +182,7 @@ class vgg16_encoder(nn.Module):
 
         layers = {}
 
-        out    = self.conv1_1(input)
-        out    = self.relu1_1(out)
-        out    = self.conv1_2(out)
-        out1   = self.relu1_2(out)
+        out1   = self.level(1, input)
 
         if self.levels < 2: 
             layers['z'] = out1
@@ -183,10 +191,7 @@ class vgg16_encoder(nn.Module):
         layers['out1'] = out1
         out, pool1_idx = self.maxpool1(out1)
 
-        out   = self.conv2_1(out)
-        out   = self.relu2_1(out)
-        out   = self.conv2_2(out)
-        out2  = self.relu2_2(out)
+        out2  = self.level(2, out)
 
         if self.levels < 3: 
             layers['z'] = out2
@@ -195,12 +200,7 @@ class vgg16_encoder(nn.Module):
         layers['out2'] = out2
         out, pool2_idx = self.maxpool2(out2)
 
-        out   = self.conv3_1(out)
-        out   = self.relu3_1(out)
-        out   = self.conv3_2(out)
-        out   = self.relu3_2(out)
-        out   = self.conv3_3(out)
-        out3  = self.relu3_3(out)
+        out3  = self.level(3, out)
 
         if self.levels < 4:
             layers['z'] = out3
@@ -209,12 +209,7 @@ class vgg16_encoder(nn.Module):
         layers['out3'] = out3
         out, pool3_idx = self.maxpool3(out3)
 
-        out   = self.conv4_1(out)
-        out   = self.relu4_1(out)
-        out   = self.conv4_2(out)
-        out   = self.relu4_2(out)
-        out   = self.conv4_3(out)
-        out4  = self.relu4_3(out)
+        out4  = self.level(4, out)
 
         
 
@@ -225,12 +220,7 @@ class vgg16_encoder(nn.Module):
         layers['out4'] = out4
         out, pool4_idx = self.maxpool3(out4)
 
-        out = self.conv5_1(out)
-        out = self.relu5_1(out)
-        out = self.conv5_2(out)
-        out = self.relu5_2(out)
-        out = self.conv5_3(out)
-        out = self.relu5_3(out)
+        out = self.level(5, out)
 
         layers['z'] = out
 
@@ -249,6 +239,8 @@ class vgg16_decoder(nn.Module):
 
         super(vgg16_decoder, self).__init__()
         self.levels = levels
+        self.memory_format = torch.contiguous_format
+        self.ckpt_levels   = set()
 
         # [14x14]
         ch_ini = 512
@@ -335,6 +327,25 @@ class vgg16_decoder(nn.Module):
                 self.outact = nn.Sigmoid()
 
 
+    def skip_cat(self, out_up, enc_out):
+        # Both tensors in the memory format of the decoder, so the concatenation keeps it (NHWC in channels-last mode)
+        return torch.cat((out_up.contiguous(memory_format=self.memory_format),
+                          enc_out.contiguous(memory_format=self.memory_format)), dim=1)
+
+    def unpool_block(self, k, out, pool_idx, enc_out):
+        out_unpool = max_unpool(getattr(self, 'unpool{}'.format(k)), out, pool_idx, enc_out)
+        out_concat = self.skip_cat(out_unpool, enc_out)
+        return getattr(self, 'conv_block{}'.format(k))(out_concat)
+
+    def deconv_block(self, k, out, enc_out):
+        out_unconv = getattr(self, 'unconv{}'.format(k))(out, output_size=enc_out.size())
+        out_concat = self.skip_cat(out_unconv, enc_out)
+        return getattr(self, 'conv_block{}'.format(k))(out_concat)
+
+    def level(self, k, block, *args):
+        # The skip concatenation is recomputed too, only the inputs of the level are kept
+        return run_level(k in self.ckpt_levels, block, k, *args)
+
     def convBlock(self, use_drop, drop_prop, use_attn, use_bn, block_size, in_ch, hid_ch, out_ch):
         hid_ch_2nd = hid_ch
 
@@ -371,35 +382,16 @@ class vgg16_decoder(nn.Module):
         out = layers['z']
         
         if self.levels > 4:
-            enc_out4   = layers['out4']
-            pool4_idx  = layers['pool4_idx']
-            out_unpool = self.unpool4(out, pool4_idx, output_size=enc_out4.size())
-            out_concat = torch.cat((out_unpool,enc_out4), dim=1)
-            out        = self.conv_block4(out_concat)
+            out = self.level(4, self.unpool_block, out, layers['pool4_idx'], layers['out4'])
 
         if self.levels > 3:
-            enc_out3   = layers['out3']
-            pool3_idx  = layers['pool3_idx']
-
-            out_unpool = self.unpool3(out, pool3_idx, output_size=enc_out3.size())
-            out_concat = torch.cat((out_unpool,enc_out3), dim=1)
-            out        = self.conv_block3(out_concat)
+            out = self.level(3, self.unpool_block, out, layers['pool3_idx'], layers['out3'])
 
         if self.levels > 2:
-            enc_out2   = layers['out2']
-            pool2_idx  = layers['pool2_idx']
-
-            out_unpool = self.unpool2(out, pool2_idx, output_size=enc_out2.size())
-            out_concat = torch.cat((out_unpool,enc_out2), dim=1)
-            out        = self.conv_block2(out_concat)
+            out = self.level(2, self.unpool_block, out, layers['pool2_idx'], layers['out2'])
 
         if self.levels > 1:
-            enc_out1   = layers['out1']
-            pool1_idx  = layers['pool1_idx']
-
-            out_unpool = self.unpool1(out, pool1_idx, output_size=enc_out1.size())
-            out_concat = torch.cat((out_unpool,enc_out1), dim=1)
-            out        = self.conv_block1(out_concat)
+            out = self.level(1, self.unpool_block, out, layers['pool1_idx'], layers['out1'])
 
         if self.levels > 0:
             out = self.convToCh(out)
@@ -418,28 +410,16 @@ class vgg16_decoder(nn.Module):
         out = layers['z']
 
         if self.levels > 4:
-            enc_out4   = layers['out4']
-            out_unconv = self.unconv4(out, output_size=enc_out4.size())
-            out_concat = torch.cat((out_unconv,enc_out4), dim=1)
-            out        = self.conv_block4(out_concat)
+            out = self.level(4, self.deconv_block, out, layers['out4'])
 
         if self.levels > 3:
-            enc_out3   = layers['out3']
-            out_unconv = self.unconv3(out, output_size=enc_out3.size())
-            out_concat = torch.cat((out_unconv,enc_out3), dim=1)    
-            out        = self.conv_block3(out_concat)   
+            out = self.level(3, self.deconv_block, out, layers['out3'])
 
         if self.levels > 2:
-            enc_out2   = layers['out2']
-            out_unconv = self.unconv2(out, output_size=enc_out2.size())
-            out_concat = torch.cat((out_unconv,enc_out2), dim=1)    
-            out        = self.conv_block2(out_concat)   
+            out = self.level(2, self.deconv_block, out, layers['out2'])
 
         if self.levels > 1:
-            enc_out1   = layers['out1']
-            out_unconv = self.unconv1(out, output_size=enc_out1.size())
-            out_concat = torch.cat((out_unconv,enc_out1), dim=1)    
-            out        = self.conv_block1(out_concat)   
+            out = self.level(1, self.deconv_block, out, layers['out1'])
 
         if self.levels > 0:
             out = self.convToCh(out)
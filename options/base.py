@@ -20,10 +20,27 @@ class baseOpt:
 		parser.add_argument('--dataset_path', default='DATASET_LR', help='path to pairs of images with subfulders train and test')
 		parser.add_argument('--model', default='advModel', help='model: advModel and VGG_ED.')
 		parser.add_argument('--gpu_ids', type=str, default='0', help='gpu ids: e.g. 0  0,1,2, 0,2. use -1 for CPU')
+		parser.add_argument('--num_threads', type=int, default=0, help='intra-op threads of the CPU path, 0 for the torch default')
+		parser.add_argument('--num_interop_threads', type=int, default=0, help='inter-op threads of the CPU path, 0 for the torch default')
 		parser.add_argument('--batch_size', type=int, default=8, help='input batch size')
+		parser.add_argument('--accum_steps', type=int, default=1, help='micro-batches of --batch_size accumulated per optimizer step')
 		parser.add_argument('--load_size', type=int, default=240, help='crop step')
 		parser.add_argument('--crop_size', type=int, default=224, help='crop step')
+		parser.add_argument('--world_size', type=int, default=1, help='data-parallel training processes started on this node (or use torchrun)')
+		parser.add_argument('--dist_backend', type=str, default='', help='backend of the distributed training: gloo, nccl, empty for nccl on GPUs and gloo on CPU')
+		parser.add_argument('--master_port', type=int, default=29500, help='port of the process group with --world_size')
+		parser.add_argument('--num_workers', type=int, default=4, help='number of worker processes building the training batches, 0 builds them in the main process')
+		parser.add_argument('--prefetch', type=int, default=2, help='number of training batches built ahead of the model')
 		parser.add_argument('--out_act', type=str, default='sigmoid', help='final activation: sigmoid, tanh')
+		parser.add_argument('--amp', type=str, default='none', help='mixed precision (autocast) for training and inference: none, fp16, bf16')
+		parser.add_argument('--compile', type=str2bool, default=False, help='compile the generator and the discriminator with torch.compile, cached in <checkpoints_dir>/compile_cache')
+		parser.add_argument('--channels_last', type=str2bool, default=False, help='run the convolutions in NHWC (channels-last) memory format')
+		parser.add_argument('--grad_ckpt', type=str, default='none', help='levels of the generator recomputed in the backward pass: none, enc, dec, top, all or a list like enc1,dec1 (enc levels only with --vgg_freezed=False)')
+		parser.add_argument('--print_freq', type=int, default=10, help='iterations between the loss reports of train.py, each one syncs the device')
+		parser.add_argument('--profile', type=str, default='', help='torch.profiler window of train.py/test.py iterations as wait,warmup,active (e.g. 5,2,3), empty to disable')
+		parser.add_argument('--profile_dir', type=str, default='results/profile', help='directory of the profiler traces and summaries')
+		parser.add_argument('--telemetry', type=str, default='', help='JSONL file of the per-iteration and per-epoch phase timings of train.py, empty to disable')
+		parser.add_argument('--telemetry_sync', type=str2bool, default=False, help='synchronize the device around every timed phase, exact per-phase GPU times')
 		parser.add_argument('--epochs', type=int, default=1000, help='number of epochs')
 		parser.add_argument('--lr1', type=float, default=2e-5, help='learning rate for the generator')
 		parser.add_argument('--lr2', type=float, default=2e-6, help='learning rate for the discriminator')
@@ -35,8 +52,25 @@ class baseOpt:
 		parser.add_argument('--upsample', type=str, default='deconv', help='upsample mode: deconv, unpool.')
 		parser.add_argument('--vgg_freezed', type=str2bool, default=True, help='make or not backpropagation on the the vgg encoder')
 		parser.add_argument('--save_epoch', type=int, default=100, help='number of epochs for saving the model')
+		parser.add_argument('--keep_ckpts', type=int, default=0, help='number of training states state-<epoch>.pth kept, 0 keeps all')
 		parser.add_argument('--load_epoch', type=int, default=0,help='load at epoch #')
+		parser.add_argument('--ckpt_format', type=str, default='pth', help='format of the saved generators: pth, flat (memory-mapped model-<epoch>.safetensors)')
+		parser.add_argument('--ckpt_half', type=str2bool, default=False, help='store the flat checkpoints in fp16')
+		parser.add_argument('--vgg_weights', type=str, default='./checkpoints/vgg16_features.pth', help='local cache of the pretrained VGG16 features, fetched once from torchvision if missing')
 		parser.add_argument('--checkpoints_dir', type=str, default='./checkpoints', help='models are saved here')
+		parser.add_argument('--infer_batch_size', type=int, default=1, help='test images of the same resolution run through the generator together')
+		parser.add_argument('--pipeline', type=str2bool, default=False, help='test with overlapped decode, inference and encode stages')
+		parser.add_argument('--decode_workers', type=int, default=2, help='decoding threads of the test pipeline')
+		parser.add_argument('--encode_workers', type=int, default=2, help='encoding/writing threads of the test pipeline')
+		parser.add_argument('--queue_size', type=int, default=8, help='size of the queues between the stages of the test pipeline')
+		parser.add_argument('--tile_size', type=int, default=0, help='inference on overlapping tiles of this size (multiple of 16), 0 runs the whole image')
+		parser.add_argument('--tile_overlap', type=int, default=32, help='overlap between tiles, blended with a linear ramp')
+		parser.add_argument('--tile_batch', type=int, default=4, help='number of tiles per forward pass')
+		parser.add_argument('--lowres_size', type=int, default=0, help='run the generator on a copy downscaled to this longest side and guided-upsample the result, 0 disables it')
+		parser.add_argument('--guided_radius', type=int, default=4, help='radius (low resolution pixels) of the guided upsampling')
+		parser.add_argument('--guided_eps', type=float, default=1e-4, help='regularization of the guided upsampling')
+		parser.add_argument('--backend', type=str, default='eager', help='inference backend: eager, torchscript, onnxruntime (export it first with export_model.py), int8 (see quantize_model.py)')
+		parser.add_argument('--format', type=str, default='torchscript', help='export format of export_model.py: torchscript, onnx, flat')
 		parser.add_argument('--sample_dir', type=str, default=None, help='sample dir to eval through the model')
 
 		return parser
@@ -47,4 +81,8 @@ class baseOpt:
 		parser = self.initialize(parser)
 
 		opt, _ = parser.parse_known_args()
-		return parser.parse_args()
\ No newline at end of file
+		opt = parser.parse_args()
+
+		# '0,1' -> [0, 1], '-1' -> [] (CPU)
+		opt.gpu_ids = [int(i) for i in opt.gpu_ids.split(',') if int(i) >= 0]
+		return opt
\ No newline at end of file
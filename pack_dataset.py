@@ -0,0 +1,16 @@
+"""
+Decode all the pairs of images of a dataset once and write them into a memory-mapped pack (see tools/pack.py).
+Once the pack exists, train.py, test.py and evalM_oneimg.py read the images from it instead of decoding the PNGs.
+
+Use:
+
+    python pack_dataset.py
+    python pack_dataset.py --dataset_path=DATASET_LR
+"""
+
+from options.base import baseOpt
+from tools.pack import pack_dataset
+
+if __name__ == '__main__':
+    opts = baseOpt().parse()
+    pack_dataset(opts.dataset_path)
@@ -0,0 +1,79 @@
+"""
+Post-training static int8 quantization of the generator of a checkpoint 'model-<epoch>.pth', for CPU
+inference (see models/quantize.py).
+
+The observers are calibrated on --calib_images flash images of the train set, the int8 generator is saved
+as a TorchScript module 'model-<epoch>.int8.torchscript.pt', then it is compared with the fp32 generator
+on the test set: time per image, speedup and PSNR/SSIM deltas.
+
+Use:
+
+    python quantize_model.py --load_epoch=1000
+    python quantize_model.py --load_epoch=1000 --calib_images=64 --bench_images=50 --num_threads=8
+
+Then run it with test.py or evalM_oneimg.py and --backend=int8.
+"""
+
+from models.models import setModel
+from models.models import to_net_tensor
+from models.backends import export_path
+from models.backends import export_torchscript
+from models.backends import TorchScriptGenerator
+from models.quantize import quantize_generator
+
+from options.base import baseOpt
+
+from tools.pre import dataset_list
+from tools.pre import get_array_uint8
+from tools.pack import load_image
+from tools.evaluation import test_pairs
+from tools.evaluation import run_quality
+
+class quantOpt(baseOpt):
+    def initialize(self, parser):
+        parser = baseOpt.initialize(self, parser)
+        parser.add_argument('--bench_images', type=int, default=0, help='number of test images compared, 0 for all')
+        parser.add_argument('--bench_warmup', type=int, default=2, help='untimed runs before measuring')
+        parser.add_argument('--calib_images', type=int, default=32, help='train flash images used to calibrate the int8 generator')
+        parser.add_argument('--qengine', type=str, default='', help='quantized engine: x86, fbgemm, qnnpack, empty for the best available')
+
+        return parser
+
+def calib_batches(opts):
+    train_set, _ = dataset_list(opts.dataset_path)
+    for _, flash_file in train_set[:opts.calib_images]:
+        img = get_array_uint8(load_image(flash_file, opts.dataset_path))
+        yield to_net_tensor([img], 'cpu', opts.out_act)
+
+def quantize_op(model, opts):
+    print('Calibrating on {:d} images...'.format(opts.calib_images))
+    qgen, qengine = quantize_generator(model.Gen, calib_batches(opts), opts.qengine)
+
+    path = export_path(opts, opts.load_epoch, 'int8')
+    export_torchscript(qgen, opts, path, 'cpu', qengine)
+    print('Exported "{}" ({})'.format(path, qengine))
+
+    # fp32 against the saved int8 artifact, on the same images
+    pairs = test_pairs(opts)
+    rows  = [('fp32',) + run_quality(model, opts, pairs, 'results/bench/fp32/')]
+
+    model.Gen = TorchScriptGenerator(path, model.device)
+    rows.append(('int8',) + run_quality(model, opts, pairs, 'results/bench/int8/'))
+
+    print('\n{:6}\t{:>10}\t{:>8}\t{:>8}\t{:>7}'.format('', 'ms/image', 'PSNR', 'SSIM', 'speedup'))
+    for name, t, psnr, ssim in rows:
+        print('{:6}\t{:10.2f}\t{:8.3f}\t{:8.4f}\t{:6.2f}x'.format(name, 1000.0*t, psnr, ssim, rows[0][1]/t))
+    print('int8 - fp32: PSNR {:+.3f} dB, SSIM {:+.4f} on {:d} images'.format(rows[1][2]-rows[0][2], rows[1][3]-rows[0][3], len(pairs)))
+
+if __name__ == "__main__":
+    # Get parameters
+    opts = quantOpt().parse()
+    # int8 kernels run on the CPU, the fp32 reference too
+    opts.gpu_ids = []
+    opts.backend = 'eager'
+
+    print('Quantizing {} model'.format(opts.model))
+    model, _ = setModel(opts, False)
+
+    model.load_model(opts.load_epoch)
+    quantize_op(model, opts)
@@ -7,6 +7,12 @@ Use:
     python test.py --load_epoch=1000
     python test.py --load_epoch=2000
     python test.py --load_epoch=100
+    python test.py --load_epoch=1000 --infer_batch_size=8
+    python test.py --load_epoch=1000 --infer_batch_size=8 --pipeline=True
+    python test.py --load_epoch=1000 --profile=1,1,4
+
+With --pipeline=True, PNG decoding, the generator and PNG encoding run as three overlapped stages (see
+tools/pipeline.py), and the occupancy of every stage is reported.
 
 See options/base.py for more details about more information of all the default parameters.
 """
@@ -14,21 +20,93 @@ See options/base.py for more details about more information of all the default p
 import os
 import numpy as np
 import time
+import torch
 
 from models.models import setModel
 
 from options.base import baseOpt
 
+from tools.pre import dataset_list
 from tools.pre import read_test_data
 from tools.pre import get_array_list_on_test
-from tools.pre import shuffle_data
-from tools.pre import get_filtered_img_objs
+from tools.pre import get_array_uint8
+from tools.pack import load_image
 from tools.post import saveimg
-
-def test_op(model, opts):
+from tools.pipeline import Stage
+from tools.pipeline import Pipeline
+from tools.profiling import Profiler
+
+def make_buckets(imgs, batch_size):
+    """Group the indices of the images by resolution, in batches of at most batch_size images."""
+    buckets = {}
+    for i, img in enumerate(imgs):
+        buckets.setdefault(img.shape, []).append(i)
+
+    batches = []
+    for idx in buckets.values():
+        for it in range(0, len(idx), batch_size):
+            batches.append(idx[it:it+batch_size])
+    return batches
+
+def get_results_path(opts):
     results_path = 'results/'+opts.model+'_'+opts.upsample+'_'+opts.out_act+'_attgen_'+str(opts.attention_gen)+'_attdis_'+str(opts.attention_dis)+'_epoch-'+str(opts.load_epoch)+'/'
     if not os.path.exists(results_path):
         os.makedirs(results_path)
+    return results_path
+
+def test_pipeline_op(model, opts):
+    results_path = get_results_path(opts)
+
+    _, test_set = dataset_list(opts.dataset_path)
+    file_list   = [f for _, f in test_set]
+    buckets     = {}
+
+    def decode(flash_file):
+        yield flash_file, get_array_uint8(load_image(flash_file, opts.dataset_path))
+
+    def run_batch(batch):
+        # no_grad is thread local, so it is set on the inference thread
+        with torch.no_grad():
+            model.set_inputs([img for _, img in batch], None)
+            model.forward()
+        return [(f, model.fake_Y[n:n+1]) for n, (f, _) in enumerate(batch)]
+
+    def infer(item):
+        # Batch of images of the same resolution
+        bucket = buckets.setdefault(item[1].shape, [])
+        bucket.append(item)
+        if len(bucket) < opts.infer_batch_size:
+            return []
+        del buckets[item[1].shape]
+        return run_batch(bucket)
+
+    def infer_flush():
+        out = []
+        for bucket in buckets.values():
+            out += run_batch(bucket)
+        buckets.clear()
+        return out
+
+    def encode(item):
+        saveimg(results_path, item[0], item[1], opts.out_act)
+        return []
+
+    stages = [Stage('decode', decode,       opts.decode_workers),
+              Stage('infer',  infer,        1, flush=infer_flush),
+              Stage('encode', encode,       opts.encode_workers)]
+
+    stats = Pipeline(stages, queue_size=opts.queue_size).run(file_list)
+
+    print('Testing [{:4d}/{:4d}]: check the results on "{}"'.format(stages[-1].items, len(file_list), results_path))
+    print('{:.2f} images/sec (batch size {:d}) in {:.2f}s'.format(len(file_list)/stats['wall_s'], opts.infer_batch_size, stats['wall_s']))
+    for st in stats['stages']:
+        print('\t{:8}\tworkers: {:d}\tbusy: {:7.2f}s\toccupancy: {:5.1f}%'.format(st['name'], st['workers'], st['busy_s'], 100.0*st['occupancy']))
+
+def test_op(model, opts):
+    if opts.pipeline:
+        return test_pipeline_op(model, opts)
+
+    results_path = get_results_path(opts)
 
     t_start = time.time()
 
@@ -37,26 +115,39 @@ def test_op(model, opts):
 
     # Get array of image objects
     data_dict = get_array_list_on_test(input_list    = img_obj_list, 
-                                       filtered_list = img_bf_obj_list,
+                                       filtered_list = None,
                                        out_act       = opts.out_act)
 
     t_end  = time.time()
     t_prep = (t_end - t_start)/(2 * len(img_obj_list))
 
-    flash_imgs    = data_dict['flash_imgs']
+    flash_imgs = data_dict['flash_imgs']
+    batches    = make_buckets(flash_imgs, opts.infer_batch_size)
+    n_imgs     = 0
 
-    for it in range(0, len(flash_imgs)):
-        # Batch of one
-        #ambnt_batch = [ambnt_imgs[it]]
-        flash_batch = [flash_imgs[it]]
-        flash_file  = file_list[it]
+    profiler = Profiler(opts, 'test', model.device)
 
-        # Set inputs of the model and run 
-        model.set_inputs(flash_batch, None)  
-        model.forward()
-        saveimg(results_path, flash_file, model.fake_Y, opts.out_act)
-        print('\riter:{:4d}/{:4d}'.format(it+1,len(flash_imgs)), end='')
-    print('\rTesting [{:4d}/{:4d}]: check the results on "{}"'.format(it+1,len(flash_imgs), results_path))
+    t_start = time.time()
+    with torch.no_grad():
+        for batch_idx in batches:
+            # Batch of images of the same resolution
+            flash_batch = [flash_imgs[i] for i in batch_idx]
+
+            # Set inputs of the model and run 
+            model.set_inputs(flash_batch, None)  
+            model.forward()
+            for n, i in enumerate(batch_idx):
+                saveimg(results_path, file_list[i], model.fake_Y[n:n+1], opts.out_act)
+
+            n_imgs += len(batch_idx)
+            print('\riter:{:4d}/{:4d}'.format(n_imgs,len(flash_imgs)), end='')
+            profiler.step()
+    t_end = time.time()
+    profiler.stop()
+
+    print('\rTesting [{:4d}/{:4d}]: check the results on "{}"'.format(n_imgs,len(flash_imgs), results_path))
+    print('{:.2f} images/sec (batch size {:d}, {:d} batches), reading {:.1f}ms/image'.format(
+        n_imgs/(t_end-t_start), opts.infer_batch_size, len(batches), 1000.0*t_prep))
 
 if __name__ == "__main__":
     # Get parameters
@@ -0,0 +1,87 @@
+"""
+Distributed data-parallel training helpers.
+
+Every process trains a replica of the model on its shard of the shuffled epoch, and the gradients of
+Gen and Dis are all-reduced by DistributedDataParallel (see models/models.py). The processes are
+started either by train.py itself on one node (--world_size=N), or by torchrun on one or several
+nodes, which sets RANK, WORLD_SIZE and LOCAL_RANK. gloo runs on CPU-only clusters, nccl on GPUs.
+
+Use:
+
+    python train.py --world_size=4 --gpu_ids=-1
+    torchrun --nnodes=2 --nproc_per_node=4 --rdzv_endpoint=HOST:29500 train.py --gpu_ids=0,1,2,3
+"""
+
+import os
+import random
+import torch
+import torch.distributed as dist
+
+_local_rank = 0
+
+def init_distributed(opts, local_rank=0):
+    """Join the process group, returns (rank, world_size), (0, 1) when not distributed."""
+    if 'WORLD_SIZE' in os.environ:
+        rank        = int(os.environ['RANK'])
+        world_size  = int(os.environ['WORLD_SIZE'])
+        local_rank  = int(os.environ.get('LOCAL_RANK', 0))
+        local_world = int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+    elif opts.world_size > 1:
+        rank        = local_rank
+        world_size  = local_world = opts.world_size
+        os.environ.setdefault('MASTER_ADDR', 'localhost')
+        os.environ.setdefault('MASTER_PORT', str(opts.master_port))
+    else:
+        return 0, 1
+
+    global _local_rank
+    _local_rank = local_rank
+
+    # One device per process, or an equal share of the cores on the CPU
+    use_cuda = len(opts.gpu_ids) > 0 and torch.cuda.is_available()
+    if use_cuda:
+        opts.gpu_ids = [opts.gpu_ids[local_rank % len(opts.gpu_ids)]]
+        torch.cuda.set_device(opts.gpu_ids[0])
+    elif opts.num_threads == 0:
+        opts.num_threads = max(1, (os.cpu_count() or 1) // local_world)
+
+    backend = opts.dist_backend or ('nccl' if use_cuda else 'gloo')
+    dist.init_process_group(backend, rank=rank, world_size=world_size)
+    return rank, world_size
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+def is_main():
+    return get_rank() == 0
+
+def is_local_main():
+    """First process of this node, the one building the node-local caches."""
+    return _local_rank == 0
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+def shared_seed():
+    """Seed drawn by rank 0 and broadcast, so every rank shuffles the epochs the same way."""
+    seed = [random.getrandbits(32)]
+    if is_distributed():
+        dist.broadcast_object_list(seed, src=0)
+    return seed[0]
+
+def shard(indices):
+    """Indices of this rank, the same number on every rank (the tail of the shuffled epoch is dropped)."""
+    world_size = get_world_size()
+    n = len(indices) // world_size * world_size
+    return indices[get_rank():n:world_size]
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
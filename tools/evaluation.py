@@ -0,0 +1,51 @@
+"""
+Quality and timing of a model on the test set, shared by benchmark.py and quantize_model.py.
+
+The options read are --bench_images (number of test pairs, 0 for all) and --bench_warmup (untimed
+runs before measuring), defined by the option classes of both scripts.
+"""
+
+import os
+import time
+import numpy as np
+import torch
+
+from tools.pre import dataset_list
+from tools.pre import get_array_uint8
+from tools.pack import load_image
+from tools.post import saveimg
+from tools.post import compute_metrics
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+def test_pairs(opts):
+    _, test_set = dataset_list(opts.dataset_path)
+    if opts.bench_images > 0:
+        test_set = test_set[:opts.bench_images]
+    return test_set
+
+def run_quality(model, opts, pairs, results_path):
+    """Mean inference time per image and mean PSNR/SSIM of the outputs against the ambient images."""
+    os.makedirs(results_path, exist_ok=True)
+
+    times   = []
+    metrics = []
+    with torch.no_grad():
+        for it, (ambnt_file, flash_file) in enumerate(pairs[:opts.bench_warmup] + pairs):
+            model.set_inputs([get_array_uint8(load_image(flash_file, opts.dataset_path))], None)
+
+            sync(model.device)
+            t0 = time.time()
+            model.forward()
+            sync(model.device)
+
+            if it < opts.bench_warmup:
+                continue
+            times.append(time.time() - t0)
+
+            saveimg(results_path, flash_file, model.fake_Y, opts.out_act)
+            metrics.append(compute_metrics(ambnt_file, results_path + flash_file.split('/')[-1]))
+
+    return np.mean(times), np.mean([m[0] for m in metrics]), np.mean([m[1] for m in metrics])
@@ -0,0 +1,148 @@
+"""
+Streaming loader for the training pairs.
+
+Instead of materializing a whole augmented epoch up-front, batches are built on
+demand by a pool of worker processes using the flip/crop/resize logic of
+tools/pre.py. At most `prefetch` batches are in flight at a time, so
+peak memory stays at a few batches whatever the size of the dataset.
+
+Batches are kept as uint8 NHWC and written by the workers straight into
+preallocated shared-memory slots; the scaling to the network range is made by
+the model on the whole batch (see set_inputs in models/models.py).
+
+Use:
+
+    loader = TrainLoader(img_obj_list, batch_size=8, load_size=240, crop_size=224)
+    for flash_batch, ambnt_batch in loader.epoch(indices):
+        ...
+    loader.close()
+"""
+
+import ctypes
+import multiprocessing as mp
+import random
+import numpy as np
+
+from collections import deque
+
+from tools.pre import image_size
+from tools.pre import sample_crop
+from tools.pre import crop_resize
+
+# Set once per worker process by _init_worker
+_worker_pairs = None
+_worker_cfg   = None
+_worker_slots = None
+
+def slot_views(buffer, cfg):
+    """[n_slots, 2(flash, ambient), batch, crop, crop, 3] uint8 view of the shared slots."""
+    shape = (cfg['n_slots'], 2, cfg['batch_size'], cfg['crop_size'], cfg['crop_size'], 3)
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(shape)
+
+def _init_worker(pairs, cfg, buffer):
+    global _worker_pairs, _worker_cfg, _worker_slots
+    _worker_pairs = pairs
+    _worker_cfg   = cfg
+    _worker_slots = slot_views(buffer, cfg)
+
+def build_batch(pairs, cfg, task, flash_out, ambnt_out):
+    """Augment the pairs listed in `task` into flash_out/ambnt_out, return the batch size."""
+    batch_idx, seed = task
+    rng = random.Random(seed)
+
+    for n, i in enumerate(batch_idx):
+        img_a, img_f = pairs[i]
+
+        flip, M, wrand, hrand = sample_crop(image_size(img_a), cfg['load_size'], rng)
+
+        img_a = crop_resize(img_a, flip, M, wrand, hrand, cfg['crop_size'])
+        img_f = crop_resize(img_f, flip, M, wrand, hrand, cfg['crop_size'])
+
+        ambnt_out[n] = np.asarray(img_a, dtype=np.uint8)
+        flash_out[n] = np.asarray(img_f, dtype=np.uint8)
+
+        img_a.close()
+        img_f.close()
+
+    return len(batch_idx)
+
+def _build_batch_worker(slot, task):
+    flash_out, ambnt_out = _worker_slots[slot]
+    return slot, build_batch(_worker_pairs, _worker_cfg, task, flash_out, ambnt_out)
+
+class TrainLoader:
+    def __init__(
+        self,
+        pairs,
+        batch_size,
+        load_size,
+        crop_size,
+        num_workers = 4,
+        prefetch    = 2):
+
+        self.pairs      = pairs
+        self.batch_size = batch_size
+        self.prefetch   = max(1, prefetch)
+        self.cfg        = {
+            'load_size' : load_size,
+            'crop_size' : crop_size,
+            'batch_size': batch_size,
+            # one slot per batch in flight, plus the one held by the model
+            'n_slots'   : self.prefetch + 1
+        }
+
+        n_bytes     = self.cfg['n_slots'] * 2 * batch_size * crop_size * crop_size * 3
+        self.buffer = mp.RawArray(ctypes.c_uint8, n_bytes)
+        self.slots  = slot_views(self.buffer, self.cfg)
+
+        self.pool = None
+        if num_workers > 0:
+            self.pool = mp.Pool(num_workers, initializer=_init_worker, initargs=(pairs, self.cfg, self.buffer))
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def tasks(self, indices):
+        # Seeds are drawn in the parent, so the augmentation only depends on the
+        # state of `random` and not on which worker builds the batch.
+        for it in range(0, len(indices), self.batch_size):
+            yield [int(i) for i in indices[it:it+self.batch_size]], random.getrandbits(32)
+
+    def epoch(self, indices):
+        """Yield uint8 NHWC (flash_batch, ambnt_batch) for `indices`, in order.
+
+        The batches are views into the shared slots, they are only valid until
+        the next batch is requested.
+        """
+        if self.pool is None:
+            flash_out, ambnt_out = self.slots[0]
+            for task in self.tasks(indices):
+                n = build_batch(self.pairs, self.cfg, task, flash_out, ambnt_out)
+                yield flash_out[:n], ambnt_out[:n]
+            return
+
+        tasks   = self.tasks(indices)
+        pending = deque()
+        free    = list(range(self.cfg['n_slots']))
+
+        def submit():
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(self.pool.apply_async(_build_batch_worker, (free.pop(), task)))
+
+        for _ in range(self.prefetch):
+            submit()
+
+        while pending:
+            slot, n = pending.popleft().get()
+            # Refill before handing the batch out, so `prefetch` batches are
+            # being built while the model runs on this one.
+            submit()
+            yield self.slots[slot, 0, :n], self.slots[slot, 1, :n]
+            free.append(slot)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,46 @@
+"""
+Loss meters kept on the device.
+
+Reading a loss with .cpu()/.item() waits for the device to finish the iteration, so doing it every
+iteration drains the CUDA queue. The meter accumulates the sum, min, max and last value of the losses
+with device ops only, and read() copies them to the host in one transfer, at the reporting interval.
+
+Use:
+
+    meter = LossMeter(['loss_R', 'loss_Gen'], model.device)
+    for ...:
+        model.optimize_parameters()
+        meter.update(model.loss_R, model.loss_Gen)
+        if it % opts.print_freq == 0:
+            print(meter.read()['loss_R']['last'])
+"""
+
+import torch
+
+class LossMeter:
+    def __init__(self, names, device):
+        self.names  = list(names)
+        self.device = torch.device(device)
+        self.reset()
+
+    def reset(self):
+        n = len(self.names)
+        self.sum   = torch.zeros(n, device=self.device)
+        self.min   = torch.full((n,), float('inf'), device=self.device)
+        self.max   = torch.full((n,), float('-inf'), device=self.device)
+        self.last  = torch.zeros(n, device=self.device)
+        self.count = 0
+
+    def update(self, *losses):
+        values = torch.stack([l.detach().float().reshape(()) for l in losses])
+        self.sum.add_(values)
+        torch.minimum(self.min, values, out=self.min)
+        torch.maximum(self.max, values, out=self.max)
+        self.last.copy_(values)
+        self.count += 1
+
+    def read(self):
+        """{name: {'mean', 'min', 'max', 'last'}} on the host, one device sync."""
+        stats = torch.stack([self.sum / max(self.count, 1), self.min, self.max, self.last]).cpu().tolist()
+        return {name: {'mean': stats[0][i], 'min': stats[1][i], 'max': stats[2][i], 'last': stats[3][i]}
+                for i, name in enumerate(self.names)}
@@ -0,0 +1,117 @@
+"""
+Pre-decoded dataset pack.
+
+All the ambient/flash pairs of a dataset are decoded once and written as raw uint8 HWC arrays into
+'datasets/<name>.pack', next to an index 'datasets/<name>.pack.json' with the name, shape and offset
+of every image. Opening the pack maps the file read-only, so every image is a zero-copy numpy view
+and parallel jobs share one copy through the OS page cache.
+
+Use:
+
+    python pack_dataset.py --dataset_path=DATASET_LR
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import numpy as np
+
+from PIL import Image
+
+from tools.pre import dataset_list
+
+source_path = 'datasets/'
+ALIGN       = 64
+
+def pack_paths(path):
+    pack_file = os.path.join(source_path, path.rstrip('/') + '.pack')
+    return pack_file, pack_file + '.json'
+
+def pack_dataset(path):
+    train_set, test_set = dataset_list(path)
+    pack_file, index_file = pack_paths(path)
+
+    entries = {}
+    offset  = 0
+    n_imgs  = 0
+    list_size = 2*(len(train_set) + len(test_set))
+
+    with open(pack_file + '.tmp', 'wb') as f:
+        for pairs in (train_set, test_set):
+            for a, fl in pairs:
+                for name in (a, fl):
+                    with Image.open(name) as img:
+                        arr = np.ascontiguousarray(np.asarray(img.convert('RGB'), dtype=np.uint8))
+
+                    pad = (-offset) % ALIGN
+                    f.write(b'\0' * pad)
+                    offset += pad
+
+                    entries[os.path.normpath(name)] = {'shape': list(arr.shape), 'offset': offset}
+                    f.write(arr.tobytes())
+                    offset += arr.nbytes
+
+                    n_imgs += 1
+                    print("\rpacking data\t: [{:3}/{:3}] {:3.1f}%".format(n_imgs, list_size, 100.0*(n_imgs/list_size)), end='')
+
+    index = {
+        'images': entries,
+        'train' : [[os.path.normpath(a), os.path.normpath(fl)] for a, fl in train_set],
+        'test'  : [[os.path.normpath(a), os.path.normpath(fl)] for a, fl in test_set]
+    }
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump(index, f)
+
+    # The pack is only visible once both files are complete
+    os.replace(pack_file + '.tmp', pack_file)
+    os.replace(index_file + '.tmp', index_file)
+
+    print("\npack size\t: {:.1f} MiB in '{}'".format(offset/2**20, pack_file))
+    return pack_file
+
+class DatasetPack:
+    def __init__(self, pack_file, index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+
+        self.data   = np.memmap(pack_file, dtype=np.uint8, mode='r')
+        self.images = index['images']
+        self.train_names = index['train']
+        self.test_names  = index['test']
+
+    def __contains__(self, name):
+        return os.path.normpath(name) in self.images
+
+    def get(self, name):
+        """Zero-copy uint8 HWC view of the image `name`."""
+        entry = self.images[os.path.normpath(name)]
+        shape = entry['shape']
+        start = entry['offset']
+        return self.data[start:start+int(np.prod(shape))].reshape(shape)
+
+    def train(self):
+        return [[self.get(a), self.get(f)] for a, f in self.train_names]
+
+    def test(self):
+        return [f for _, f in self.test_names], [self.get(f) for _, f in self.test_names]
+
+_packs = {}
+
+def open_pack(path):
+    """Open the pack of the dataset `path`, or return None if it was not packed."""
+    pack_file, index_file = pack_paths(path)
+    if pack_file not in _packs:
+        if not (os.path.exists(pack_file) and os.path.exists(index_file)):
+            return None
+        _packs[pack_file] = DatasetPack(pack_file, index_file)
+    return _packs[pack_file]
+
+def load_image(name, path):
+    """Image `name` as a view into the pack of `path` when packed, decoded with PIL otherwise."""
+    pack = open_pack(path)
+    if pack is not None and name in pack:
+        return pack.get(name)
+
+    with Image.open(name) as img:
+        return img.copy()
@@ -0,0 +1,123 @@
+"""
+Pipelined executor of stages connected by bounded queues.
+
+Every stage runs `workers` threads calling `fn(item)`, which returns an iterable with the items for
+the next stage (possibly empty, e.g. while a batch is being filled). When the input is exhausted, the
+optional `flush()` of the stage returns the items it still holds. PIL decoding, PNG encoding and the
+model release the GIL, so threads are enough to overlap them.
+
+The busy time of every stage is counted, occupancy = busy / (wall time * workers); the stage close to
+100% is the bottleneck of the pipeline.
+
+Use:
+
+    stages = [Stage('decode', decode, 2), Stage('infer', infer, 1, flush=infer_flush), Stage('encode', encode, 2)]
+    stats  = Pipeline(stages, queue_size=8).run(files)
+"""
+
+import threading
+import queue
+import time
+
+_END = object()
+
+class Stage:
+    def __init__(self, name, fn, workers=1, flush=None):
+        self.name    = name
+        self.fn      = fn
+        self.workers = max(1, workers)
+        self.flush   = flush
+
+        self.busy    = 0.0
+        self.items   = 0
+        self.lock    = threading.Lock()
+        self.alive   = self.workers
+
+    def count(self, t, n=1):
+        with self.lock:
+            self.busy  += t
+            self.items += n
+
+class Pipeline:
+    def __init__(self, stages, queue_size=8):
+        self.stages     = stages
+        self.queue_size = queue_size
+        self.error      = None
+
+    def _worker(self, stage, qin, qout, n_next):
+        while True:
+            item = qin.get()
+            if item is _END:
+                break
+            if self.error is not None:
+                continue
+            try:
+                t0  = time.time()
+                out = list(stage.fn(item))
+                stage.count(time.time() - t0)
+                for o in out:
+                    qout.put(o)
+            except Exception as e:
+                self.error = e
+
+        with stage.lock:
+            stage.alive -= 1
+            last = stage.alive == 0
+
+        # The last worker of the stage flushes it and ends the next stage
+        if last:
+            if stage.flush is not None and self.error is None:
+                try:
+                    t0  = time.time()
+                    out = list(stage.flush())
+                    stage.count(time.time() - t0, 0)
+                    for o in out:
+                        qout.put(o)
+                except Exception as e:
+                    self.error = e
+            for _ in range(n_next):
+                qout.put(_END)
+
+    def _drain(self, qin):
+        while qin.get() is not _END:
+            pass
+
+    def run(self, items):
+        queues  = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages)+1)]
+        threads = []
+
+        for k, stage in enumerate(self.stages):
+            n_next = self.stages[k+1].workers if k+1 < len(self.stages) else 1
+            for _ in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(stage, queues[k], queues[k+1], n_next), daemon=True)
+                t.start()
+                threads.append(t)
+
+        # Outputs of the last stage are dropped
+        drain = threading.Thread(target=self._drain, args=(queues[-1],), daemon=True)
+        drain.start()
+
+        t_start = time.time()
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_END)
+
+        for t in threads:
+            t.join()
+        drain.join()
+        wall = time.time() - t_start
+
+        if self.error is not None:
+            raise self.error
+
+        return {
+            'wall_s' : wall,
+            'stages' : [{
+                'name'      : s.name,
+                'workers'   : s.workers,
+                'items'     : s.items,
+                'busy_s'    : s.busy,
+                'occupancy' : s.busy / (wall * s.workers) if wall > 0 else 0.0
+            } for s in self.stages]
+        }
@@ -48,86 +48,40 @@ def random_crop(img, crop_size, wrand, hrand):
     img = img.crop((wrand, hrand, wrand+crop_size, hrand+crop_size))
     return img
 
-def get_array_list_on_train(
-    input_list    = None,
-    filtered_list = None, 
-    crop          = True, 
-    load_min_size = None,
-    out_size      = None,
-    out_act       = 'tanh'):
-
-    ambnt_list = []
-    flash_list = []
-    
-    ambnt_bf_list = []
-    flash_bf_list = []
-
-    for iobj, (img_a, img_f) in enumerate(input_list):
-        #img_a.show()
-        #img_f.show()
-        if filtered_list:
-            img_a_bf, img_f_bf = filtered_list[iobj]
-
-        if crop:
-            flip_rand = random.random()
-            if flip_rand < 0.5:
-                img_a = img_a.transpose(Image.FLIP_LEFT_RIGHT)
-                img_f = img_f.transpose(Image.FLIP_LEFT_RIGHT)
-
-            M     = load_min_size * random.uniform(0.8, 1.0)
-            wrand = random.randint(0, int(img_a.size[0]-M))
-            hrand = random.randint(0, int(img_a.size[1]-M))
- 
-            img_a = random_crop(img_a, M, wrand, hrand)
-            img_f = random_crop(img_f, M, wrand, hrand)
-            
-            img_a = img_a.resize([out_size, out_size], Image.ANTIALIAS)
-            img_f = img_f.resize([out_size, out_size], Image.ANTIALIAS)
-
-            if filtered_list:
-                if flip_rand < 0.5:
-                    img_a_bf = img_a_bf.transpose(Image.FLIP_LEFT_RIGHT)
-                    img_f_bf = img_f_bf.transpose(Image.FLIP_LEFT_RIGHT)    
-
-                img_a_bf = random_crop(img_a_bf, M, wrand, hrand)
-                img_f_bf = random_crop(img_f_bf, M, wrand, hrand)
-                img_a_bf = img_a_bf.resize([out_size, out_size], Image.ANTIALIAS)
-                img_f_bf = img_f_bf.resize([out_size, out_size], Image.ANTIALIAS)
-
-
-                #img_a_bf.show()
-                #img_f_bf.show()
-
-        #img_a.show()
-        #img_f.show()
-
-        if filtered_list:
-            img_a_bf_out = get_array_to_net(img_a_bf, out_act)
-            img_f_bf_out = get_array_to_net(img_f_bf, out_act)
-
-            ambnt_bf_list.append(img_a_bf_out)
-            flash_bf_list.append(img_f_bf_out)
-
-            img_a_bf.close()
-            img_f_bf.close()
-
-        img_a_out = get_array_to_net(img_a, out_act)
-        img_f_out = get_array_to_net(img_f, out_act)
-
-        ambnt_list.append(img_a_out)
-        flash_list.append(img_f_out)
-        
-        img_a.close()
-        img_f.close()
-
-    data_dict = {
-            'ambnt_imgs'    : ambnt_list,
-            'flash_imgs'    : flash_list,
-            'ambnt_bf_imgs' : ambnt_bf_list,
-            'flash_bf_imgs' : flash_bf_list
-    }
-
-    return data_dict
+def sample_crop(img_size, load_min_size, rng=random):
+    """Draw the random flip, crop size and crop corner for one training pair."""
+    flip  = rng.random() < 0.5
+    M     = load_min_size * rng.uniform(0.8, 1.0)
+    wrand = rng.randint(0, int(img_size[0]-M))
+    hrand = rng.randint(0, int(img_size[1]-M))
+
+    return flip, M, wrand, hrand
+
+def image_size(img):
+    if isinstance(img, np.ndarray):
+        return img.shape[1], img.shape[0]
+    return img.size
+
+def crop_resize(img, flip, M, wrand, hrand, out_size):
+    if isinstance(img, np.ndarray):
+        # Packed image: slice the (flipped) crop box out of the view, so only
+        # the crop is copied before resizing
+        W      = img.shape[1]
+        x0, x1 = wrand, int(round(wrand+M))
+        y0, y1 = hrand, int(round(hrand+M))
+        if flip:
+            x0, x1 = W-x1, W-x0
+        img = img[y0:y1, x0:x1]
+        if flip:
+            img = img[:, ::-1]
+        img = Image.fromarray(np.ascontiguousarray(img))
+        return img.resize([out_size, out_size], Image.ANTIALIAS)
+
+    if flip:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    img = random_crop(img, M, wrand, hrand)
+    img = img.resize([out_size, out_size], Image.ANTIALIAS)
+    return img
 
 def get_array_list_on_test(
     input_list    = None,
@@ -145,15 +99,16 @@ def get_array_list_on_test(
     for iobj, img_f in enumerate(input_list):
         if filtered_list:
             img_f_bf     = filtered_list[iobj]
-            img_f_bf_out = get_array_to_net(img_f_bf)
+            img_f_bf_out = get_array_uint8(img_f_bf)
 
             flash_bf_list.append(img_f_bf_out)
             img_f_bf.close()
 
-        img_f_out = get_array_to_net(img_f, out_act)
+        img_f_out = get_array_uint8(img_f)
         flash_list.append(img_f_out)
 
-        img_f.close()
+        if not isinstance(img_f, np.ndarray):
+            img_f.close()
 
     data_dict = {
             'flash_imgs'    : flash_list,
@@ -162,16 +117,20 @@ def get_array_list_on_test(
 
     return data_dict
 
-def get_array_to_net(im, out_act):
-    img_arr = np.asarray(im, dtype=np.float32)/255.0
-    if out_act == 'tanh': 
-        img_arr = img_arr * 2.0 - 1.0
-    img_arr = np.transpose(img_arr, (2, 0, 1))
+def get_array_uint8(im):
+    """HWC uint8 array of the image, the scaling to the network range is made by the model on the batch."""
+    return np.ascontiguousarray(np.asarray(im, dtype=np.uint8))
 
-    return img_arr
+def read_train_data(path):
+    from tools.pack import open_pack
 
+    pack = open_pack(path)
+    if pack is not None:
+        im_list = pack.train()
+        print("reading pack\t: {:d} pairs of images mapped".format(len(im_list)))
+        print("train size\t: {:d} pairs of images".format(len(im_list)), end='\n\n')
+        return im_list
 
-def read_train_data(path):
     data_list, _ = dataset_list(path)
 
     im_list = []
@@ -194,6 +153,15 @@ def read_train_data(path):
     return im_list
 
 def read_test_data(path):
+    from tools.pack import open_pack
+
+    pack = open_pack(path)
+    if pack is not None:
+        file_list, im_list = pack.test()
+        print("reading pack\t: {:d} images mapped".format(len(im_list)))
+        print("test size\t: {:d} pairs of images".format(len(im_list)), end='\n\n')
+        return file_list, im_list
+
     _, data_list = dataset_list(path)
 
     im_list   = []
@@ -0,0 +1,118 @@
+"""
+Host-to-device prefetcher for the training batches.
+
+A background thread takes the uint8 (flash_batch, ambnt_batch) numpy batches of the
+loader, copies them into two page-locked buffers and starts the transfer to the GPU
+on a side stream, so batch N+1 is already on its way while the model runs on batch N.
+On CPU-only hosts it is a plain two-slot queue filled by the same thread.
+
+The time the training loop spends blocked waiting on the next batch is counted, see stats().
+
+Use:
+
+    prefetcher = DevicePrefetcher(loader.epoch(indices), model.device)
+    for flash_batch, ambnt_batch in prefetcher:
+        model.set_inputs(flash_batch, ambnt_batch)
+        ...
+    print(prefetcher.stats())
+"""
+
+import threading
+import queue
+import time
+import torch
+
+_END = object()
+
+class DevicePrefetcher:
+    def __init__(self, batches, device, depth=2):
+        self.batches = batches
+        self.device  = torch.device(device)
+        self.cuda    = self.device.type == 'cuda' and torch.cuda.is_available()
+        self.queue   = queue.Queue(maxsize=max(1, depth-1))
+
+        if self.cuda:
+            self.stream = torch.cuda.Stream(device=self.device)
+            self.pinned = [None] * depth
+            self.events = [None] * depth
+
+        self.n_batches = 0
+        self.wait_time = 0.0
+        self.t_start   = None
+        self.t_end     = None
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _to_pinned(self, slot, arrays):
+        # The buffer of this slot can only be overwritten once its last copy is done
+        if self.events[slot] is not None:
+            self.events[slot].synchronize()
+
+        n = len(arrays[0])
+        if self.pinned[slot] is None or self.pinned[slot][0].shape[1:] != arrays[0].shape[1:] or len(self.pinned[slot][0]) < n:
+            self.pinned[slot] = [torch.empty(a.shape, dtype=torch.uint8).pin_memory() for a in arrays]
+
+        out = []
+        for buf, a in zip(self.pinned[slot], arrays):
+            buf[:n].copy_(torch.from_numpy(a))
+            out.append(buf[:n])
+        return out
+
+    def _run(self):
+        try:
+            if self.cuda:
+                torch.cuda.set_device(self.device)
+
+            for it, arrays in enumerate(self.batches):
+                if self.cuda:
+                    slot   = it % len(self.pinned)
+                    pinned = self._to_pinned(slot, arrays)
+                    with torch.cuda.stream(self.stream):
+                        tensors = [t.to(self.device, non_blocking=True) for t in pinned]
+                        self.events[slot] = self.stream.record_event()
+                    self.queue.put((tensors, self.events[slot]))
+                else:
+                    # The loader reuses its buffers, so the batch is copied out
+                    self.queue.put(([torch.from_numpy(a).clone() for a in arrays], None))
+        except Exception as e:
+            self.queue.put(e)
+        self.queue.put(_END)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t0 = time.time()
+        if self.t_start is None:
+            self.t_start = t0
+
+        item = self.queue.get()
+        self.wait_time += time.time() - t0
+
+        if item is _END:
+            self.t_end = time.time()
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+
+        tensors, event = item
+        if event is not None:
+            stream = torch.cuda.current_stream(self.device)
+            stream.wait_event(event)
+            for t in tensors:
+                t.record_stream(stream)
+
+        self.n_batches += 1
+        return tuple(tensors)
+
+    def stats(self):
+        """Number of batches, seconds blocked on input and its fraction of the elapsed time."""
+        t_end   = self.t_end if self.t_end is not None else time.time()
+        elapsed = (t_end - self.t_start) if self.t_start is not None else 0.0
+        return {
+            'batches'   : self.n_batches,
+            'wait_s'    : self.wait_time,
+            'elapsed_s' : elapsed,
+            'wait_frac' : self.wait_time / elapsed if elapsed > 0 else 0.0
+        }
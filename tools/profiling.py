@@ -0,0 +1,99 @@
+"""
+Opt-in torch.profiler capture of a window of iterations, for train.py and test.py.
+
+--profile=WAIT,WARMUP,ACTIVE skips WAIT iterations, runs WARMUP iterations with the profiler on but
+discarded, then records ACTIVE iterations: operator times, memory and input shapes, on the CPU and on
+CUDA. The trace is written to <profile_dir>/<script>/ for TensorBoard (torch-tb-profiler) or Chrome
+(chrome://tracing, Perfetto), with a summary of the top operators under each module label of the
+networks (vgg16_encoder, vgg16_decoder, discriminator) in summary.txt. The summary covers the forward passes,
+the backward and optimizer ops run outside the labels and are in the trace only.
+
+Use:
+
+    python train.py --profile=5,2,3
+    python test.py --load_epoch=1000 --profile=1,1,4
+    tensorboard --logdir=results/profile
+"""
+
+import os
+import torch
+
+from torch.profiler import ProfilerActivity
+
+# record_function labels of models/nets.py
+MODULES = ('vgg16_encoder', 'vgg16_decoder', 'discriminator')
+
+def parse_window(spec):
+    wait, warmup, active = [int(n) for n in spec.split(',')]
+    return wait, warmup, active
+
+def self_device_time(e):
+    # Renamed from the CUDA specific name in recent versions
+    return getattr(e, 'self_device_time_total', None) or getattr(e, 'self_cuda_time_total', 0)
+
+def module_of(e):
+    while e is not None:
+        if e.name in MODULES:
+            return e.name
+        e = e.cpu_parent
+    return None
+
+def module_summary(events, top=10):
+    """Table of the `top` operators by self time under each module label, in ms over the window."""
+    totals = {}
+    for e in events:
+        module = module_of(e.cpu_parent)
+        if module is None or e.name in MODULES:
+            continue
+        cpu, device, count = totals.get((module, e.name), (0.0, 0.0, 0))
+        totals[(module, e.name)] = (cpu + e.self_cpu_time_total, device + self_device_time(e), count + 1)
+
+    lines = []
+    for module in MODULES:
+        ops = sorted(((name, t) for (m, name), t in totals.items() if m == module), key=lambda x: -max(x[1][0], x[1][1]))
+        if not ops:
+            continue
+        lines.append('\n{}'.format(module))
+        lines.append('{:40}\t{:>10}\t{:>10}\t{:>7}'.format('operator', 'CPU ms', 'device ms', 'calls'))
+        for name, (cpu, device, count) in ops[:top]:
+            lines.append('{:40}\t{:10.2f}\t{:10.2f}\t{:7d}'.format(name[:40], cpu/1000.0, device/1000.0, count))
+    return '\n'.join(lines)
+
+class Profiler:
+    """torch.profiler over the --profile window, a no-op without it. step() after every iteration."""
+    def __init__(self, opts, name, device, enabled=True):
+        self.prof = None
+        if not (opts.profile and enabled):
+            return
+
+        wait, warmup, active = parse_window(opts.profile)
+        self.trace_dir = os.path.join(opts.profile_dir, name)
+        self.handler   = torch.profiler.tensorboard_trace_handler(self.trace_dir)
+
+        activities = [ProfilerActivity.CPU]
+        if torch.device(device).type == 'cuda':
+            activities.append(ProfilerActivity.CUDA)
+
+        self.prof = torch.profiler.profile(activities     = activities,
+                                           schedule       = torch.profiler.schedule(wait=wait, warmup=warmup, active=active, repeat=1),
+                                           on_trace_ready = self.trace_ready,
+                                           record_shapes  = True,
+                                           profile_memory = True)
+        self.prof.start()
+
+    def trace_ready(self, prof):
+        self.handler(prof)
+        summary = module_summary(prof.events())
+        with open(os.path.join(self.trace_dir, 'summary.txt'), 'w') as f:
+            f.write(summary + '\n')
+        print('\nProfiler trace written to "{}"'.format(self.trace_dir))
+        print(summary)
+
+    def step(self):
+        if self.prof is not None:
+            self.prof.step()
+
+    def stop(self):
+        if self.prof is not None:
+            self.prof.stop()
+            self.prof = None
@@ -0,0 +1,122 @@
+"""
+Per-phase timing of the training loop, written as JSON lines.
+
+The phases of an iteration are timed as they run: waiting on the loader (the augmentation workers),
+set_inputs (the transfer and scaling of the batch), the forward/backward passes of the networks and
+the optimizer steps (see optimize_parameters in models/models.py). Every iteration and every epoch
+produce a record with the seconds of each phase, the images, images/sec and the memory: on CUDA the
+peak of the allocator since the start of the epoch ('peak_mem_mib'), on the CPU the peak RSS since
+the start of the process ('process_peak_rss_mib', it never resets; null without the resource
+module). CUDA kernels run asynchronously, so with --telemetry_sync=False the phases measure the
+launch time; --telemetry_sync=True synchronizes the device around every phase.
+
+Use:
+
+    python train.py --telemetry=results/train.jsonl --telemetry_sync=True
+
+    {"type": "iter", "epoch": 1, "iter": 3, "images": 8, "time": 0.41, "images_per_sec": 19.5,
+     "phases": {"data": 0.01, "set_inputs": 0.002, "gen_forward": 0.09, ...}, "peak_mem_mib": 2210.4, ...}
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+import torch
+
+_END = object()
+
+class Telemetry:
+    def __init__(self, device, path='', sync=False):
+        self.device = torch.device(device)
+        self.sync   = sync and self.device.type == 'cuda'
+        self.file   = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = open(path, 'a', buffering=1)
+
+        self.iter_phases  = {}
+        self.epoch_phases = {}
+        self.epoch_images = 0
+        self.t_iter  = time.perf_counter()
+        self.t_epoch = self.t_iter
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.sync:
+                torch.cuda.synchronize(self.device)
+            self.iter_phases[name] = self.iter_phases.get(name, 0.0) + time.perf_counter() - t0
+
+    def timed(self, iterable, name):
+        """The items of `iterable`, the time spent waiting on each one counted in the phase `name`."""
+        it = iter(iterable)
+        while True:
+            with self.phase(name):
+                item = next(it, _END)
+            if item is _END:
+                return
+            yield item
+
+    def peak_memory(self):
+        """{'peak_mem_mib': peak of the epoch} on CUDA, {'process_peak_rss_mib': peak of the process} on the CPU."""
+        if self.device.type == 'cuda':
+            return {'peak_mem_mib': torch.cuda.max_memory_allocated(self.device) / 2**20}
+        try:
+            import resource
+        except ImportError:
+            # Windows
+            return {'process_peak_rss_mib': None}
+        # ru_maxrss is in KiB on Linux, in bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'process_peak_rss_mib': rss / (2**20 if sys.platform == 'darwin' else 2**10)}
+
+    def write(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps(record) + '\n')
+
+    def start_epoch(self):
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.epoch_phases = {}
+        self.epoch_images = 0
+        self.iter_phases  = {}
+        self.t_epoch = self.t_iter = time.perf_counter()
+
+    def end_iteration(self, ep, it, n_images, **extra):
+        now     = time.perf_counter()
+        elapsed = now - self.t_iter
+        self.t_iter = now
+
+        for name, t in self.iter_phases.items():
+            self.epoch_phases[name] = self.epoch_phases.get(name, 0.0) + t
+        self.epoch_images += n_images
+
+        record = {'type': 'iter', 'epoch': ep, 'iter': it, 'images': n_images, 'time': elapsed,
+                  'images_per_sec': n_images / elapsed, 'phases': self.iter_phases}
+        record.update(self.peak_memory())
+        record.update(extra)
+        self.write(record)
+        self.iter_phases = {}
+
+    def end_epoch(self, ep, **extra):
+        """Record of the epoch, also returned for the console."""
+        elapsed = time.perf_counter() - self.t_epoch
+        record  = {'type': 'epoch', 'epoch': ep, 'images': self.epoch_images, 'time': elapsed,
+                   'images_per_sec': self.epoch_images / elapsed, 'phases': self.epoch_phases}
+        record.update(self.peak_memory())
+        record.update(extra)
+        self.write(record)
+        return record
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -2,104 +2,167 @@
 This script works for a encoder-decoder network(EDNet) and a Conditional Adversarial Network(cGAN). It 
 first load the dataset(pairs of filenames).
 
-Next, we read all the images, perform data augmentation and suffle the list of images on each epoch. Finally,
-we run the model on each batch of images.
+Next, we read all the images and suffle the list of images on each epoch. The batches are augmented on
+demand by a pool of worker processes (see tools/loader.py). Finally, we run the model on each batch of images.
 
 Use:
 
     python train.py
     python train.py --batch-size=32
     python train.py --batch-size=64 --save_epoch=1000
+    python train.py --world_size=4 --gpu_ids=-1
+    python train.py --profile=5,2,3
 
 See options/base.py for more details about more information of all the default parameters.
 """
 
 from models.models import setModel
+from models.nets import vgg16_features
+from models.checkpoint import AsyncCheckpointer
+from models.checkpoint import load_training_state
+from models.checkpoint import rng_state
+from models.checkpoint import set_rng_state
 from options.base import baseOpt
 
 from tools.pre import read_train_data
-from tools.pre import get_array_list_on_train
-from tools.pre import get_array_to_net
-from tools.pre import shuffle_data
-from tools.pre import get_filtered_img_objs
+from tools.loader import TrainLoader
+from tools.prefetch import DevicePrefetcher
+from tools.telemetry import Telemetry
+from tools.meters import LossMeter
+from tools.profiling import Profiler
+from tools import distributed
 
 import numpy as np
+import random
 import time
 import os
+import torch
+import torch.multiprocessing as mp
 from PIL import Image
 
 def train_op(model, opts, isAdv):
-    if not os.path.exists('checkpoints'):
-        os.makedirs('checkpoints')
+    os.makedirs(opts.checkpoints_dir, exist_ok=True)
 
     # Make a list of pairs of ambient and flash image filenames
     img_obj_list = read_train_data(path=opts.dataset_path)
-    train_size   = len(img_obj_list)
-    indices      = np.arange(train_size)
+    indices      = np.arange(len(img_obj_list))
+    # Images per epoch of this process, all of them when not distributed
+    train_size   = len(distributed.shard(indices))
+    is_main      = distributed.is_main()
     
-    img_bf_obj_list = None
+    loader = TrainLoader(img_obj_list,
+                         batch_size  = opts.batch_size,
+                         load_size   = opts.load_size,
+                         crop_size   = opts.crop_size,
+                         num_workers = opts.num_workers,
+                         prefetch    = opts.prefetch)
+    checkpointer = AsyncCheckpointer(opts, opts.keep_ckpts)
+    # Phase timings of train_op and optimize_parameters, recorded by the first process
+    telemetry    = Telemetry(model.device, opts.telemetry if is_main else '', opts.telemetry_sync)
+    model.telemetry = telemetry
+    profiler     = Profiler(opts, 'train', model.device, enabled=is_main)
+
+    # Losses accumulated on the device, read back every {opts.print_freq} iterations
+    names = ['loss_R', 'loss_Gen', 'loss_Dis'] if isAdv else ['loss_R']
+    meter = LossMeter(names, model.device)
 
     for ep in range(opts.load_epoch+1, opts.load_epoch+opts.epochs+1):
         start = time.time()
-        # Get array of the images, make data augmentation and random shuffle
-        data_dict = get_array_list_on_train(input_list    = img_obj_list, 
-                                            filtered_list = img_bf_obj_list,
-                                            load_min_size = opts.load_size, 
-                                            out_size      = opts.crop_size,
-                                            out_act       = opts.out_act)
-
-        ambnt_imgs = np.array(data_dict['ambnt_imgs'])
-        flash_imgs = np.array(data_dict['flash_imgs'])
-        
+        # Random shuffle, the data augmentation is made by the loader workers
         np.random.shuffle(indices)
         
-        ambnt_imgs = ambnt_imgs[indices]
-        flash_imgs = flash_imgs[indices]    
-        
-        loss_it  = []
-        loss_gen = []
-        loss_dis = []
-
-        for it in range(0, len(ambnt_imgs), opts.batch_size):
-            # Batch of images
-            ambnt_batch = ambnt_imgs[it:it+opts.batch_size]
-            flash_batch = flash_imgs[it:it+opts.batch_size]
-            
+        meter.reset()
+        n_seen   = 0
+
+        prefetcher = DevicePrefetcher(loader.epoch(distributed.shard(indices)), model.device)
+        telemetry.start_epoch()
+
+        for it, (flash_batch, ambnt_batch) in enumerate(telemetry.timed(prefetcher, 'data')):
+            n_seen += len(flash_batch)
+
             # Set inputs of the model and run 
-            model.set_inputs(flash_batch, ambnt_batch)              
+            with telemetry.phase('set_inputs'):
+                model.set_inputs(flash_batch, ambnt_batch)              
 
-            model.optimize_parameters()
-            loss_it.append(model.loss_R.cpu().detach().numpy())
+            # The last batch of the epoch also flushes the accumulated gradients
+            model.optimize_parameters(last=(n_seen == train_size))
+            meter.update(*[getattr(model, name) for name in names])
 
             # Reporting loss value
-            print('\riter:{:4d}/{:4d}, loss_batch(R): {:.4f}'.format(int(it+opts.batch_size),train_size,loss_it[-1]), end='')
-            
-            if isAdv:
-                loss_gen.append(model.loss_Gen.cpu().detach().numpy())
-                loss_dis.append(model.loss_Dis.cpu().detach().numpy())
-                print(', loss_gen: {:.4f}, loss_dis: {:.4f}'.format(loss_gen[-1], loss_dis[-1]), end='')
+            losses = {}
+            if (it+1) % opts.print_freq == 0 or n_seen == train_size:
+                losses = {name: v['last'] for name, v in meter.read().items()}
+                if is_main:
+                    print('\riter:{:4d}/{:4d}, loss_batch(R): {:.4f}'.format(n_seen,train_size,losses['loss_R']), end='')
+                    if isAdv:
+                        print(', loss_gen: {:.4f}, loss_dis: {:.4f}'.format(losses['loss_Gen'], losses['loss_Dis']), end='')
+
+            telemetry.end_iteration(ep, it, len(flash_batch), **losses)
+            profiler.step()
            
+        stats = meter.read()
         end = time.time()
 
-        print('\repochs: {:4d}, loss_batch(R):{:.4f}'.format(ep, np.mean(loss_it)), end='')
-        if isAdv:
-            print(', loss_gen: {:.4f}, loss_dis: {:.4f}'.format(np.mean(loss_gen), np.mean(loss_dis)), end='')
-        print(' in {:3.2f}s'.format(end-start))
+        losses = {name + '_' + k: v[k] for name, v in stats.items() for k in ('mean', 'min', 'max')}
+        record = telemetry.end_epoch(ep, input_wait_frac=prefetcher.stats()['wait_frac'], **losses)
+
+        if is_main:
+            print('\repochs: {:4d}, loss_batch(R):{:.4f}'.format(ep, stats['loss_R']['mean']), end='')
+            if isAdv:
+                print(', loss_gen: {:.4f}, loss_dis: {:.4f}'.format(stats['loss_Gen']['mean'], stats['loss_Dis']['mean']), end='')
+            print(' in {:3.2f}s, {:.1f} images/s (input wait {:.1f}%)'.format(end-start, record['images_per_sec'], 100.0*prefetcher.stats()['wait_frac']))
 
-        # Save model each {opts.save_epoch} epochs
-        if ep % opts.save_epoch == 0: 
+        # Save model each {opts.save_epoch} epochs, written in background, by the first process only
+        if ep % opts.save_epoch == 0 and is_main: 
             print('saving model at epoch {:4d}'.format(ep))
-            model.save_model(ep)
+            state = model.training_state()
+            state['rng']   = rng_state()
+            state['epoch'] = ep
+            checkpointer.save(state, ep)
+
+    profiler.stop()
+    checkpointer.wait()
+    telemetry.close()
+    loader.close()
+
+def main(local_rank, opts):
+    rank, world_size = distributed.init_distributed(opts, local_rank)
+    if world_size > 1:
+        # Same shuffles and initialization on every process, different augmentations
+        seed = distributed.shared_seed()
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        random.seed(seed + rank)
+
+        # The VGG16 features cache is built once per node, the other processes wait for it
+        if distributed.is_local_main():
+            vgg16_features(opts.vgg_weights)
+        distributed.barrier()
 
-if __name__ == '__main__':
-    # Get parameters
-    opts  = baseOpt().parse()
-    
     # Build model, and run test
     model, isAdv = setModel(opts)
 
-    # Loading a model
+    # Resuming the training state, or loading a model
     if opts.load_epoch > 0:
-        print('Loading model at epoch {:d}'.format(opts.load_epoch))
-        model.load_model(opts.load_epoch)
-    train_op(model, opts, isAdv)
\ No newline at end of file
+        state = load_training_state(opts, opts.load_epoch)
+        if state is not None:
+            print('Resuming training at epoch {:d}'.format(opts.load_epoch))
+            model.load_training_state(state)
+            set_rng_state(state['rng'])
+            if world_size > 1:
+                random.seed(random.getrandbits(64) + rank)
+        else:
+            print('Loading model at epoch {:d} (no training state, optimizers start over)'.format(opts.load_epoch))
+            model.load_model(opts.load_epoch)
+    train_op(model, opts, isAdv)
+    distributed.cleanup()
+
+if __name__ == '__main__':
+    # Get parameters
+    opts  = baseOpt().parse()
+
+    if opts.world_size > 1 and 'WORLD_SIZE' not in os.environ:
+        # One process per replica on this node, torchrun starts them itself
+        mp.spawn(main, args=(opts,), nprocs=opts.world_size)
+    else:
+        main(0, opts)
\ No newline at end of file